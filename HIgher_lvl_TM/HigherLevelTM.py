@@ -1,19 +1,61 @@
 import time
+from collections import namedtuple
 from VisualTM import VisualTM
+from tracers import PrintTracer
+from instruction_compiler import Op, LITERAL, MARKER, HEAD, compile_instructions
+import checkpoint
+import tapes
+import kernels
+import loop_fusion
+import codegen_engine
+import flat_vm
 
-class HigherLevelTM:
-    # Instruction limit cause I did crash VS Code while troubleshooting lol
-    INSTRUCTION_LIMIT = 100000
+FUSED = Op.FUSED
 
-    def __init__(self, turing_machine, SPEED, VISUALS):
-        self.instructions = turing_machine["instructions"]
+# Run statuses
+ACCEPTED = "ACCEPTED"
+OUT_OF_BUDGET = "OUT_OF_BUDGET"
+
+# Execution engines: the reference interpreter, the program compiled to Python (see codegen_engine.py)
+# or lowered to a flat instruction array with optional per instruction counters (see flat_vm.py)
+REFERENCE = "reference"
+COMPILED = "compiled"
+VM = "vm"
+ENGINES = (REFERENCE, COMPILED, VM)
+
+# status: ACCEPTED or OUT_OF_BUDGET, steps: executed by this run, total_steps: executed by the machine so far,
+# elapsed: seconds spent in this run, output: the computed digits (None unless accepted)
+RunResult = namedtuple("RunResult", ["status", "steps", "total_steps", "elapsed", "output"])
+
+
+class HigherLevelTM:
+    def __init__(self, turing_machine, SPEED, VISUALS, BATCH=False, tracer=None, TAPE=tapes.INT64, FUSE_LOOPS=False, ENGINE=REFERENCE):
+        # Replace recognized array loops with native kernels (see loop_fusion.py)
+        self.FUSE_LOOPS = FUSE_LOOPS
+        # Compiled engine, only used for batch runs without a tracer (everything else needs every single step)
+        if ENGINE not in ENGINES:
+            raise ValueError(f"unknown engine '{ENGINE}', expected one of {ENGINES}")
+        self.ENGINE = ENGINE
+        self.loadMacro(turing_machine)
+        # Op -> handler, indexed by the opcode number so there's no string matching per step
+        self.dispatch = [None] * len(Op)
+        for op, handler in [
+            (Op.READ, self.opRead), (Op.ADD, self.opAdd), (Op.SUB, self.opSub), (Op.MUL, self.opMul),
+            (Op.DIV, self.opDiv), (Op.MOD, self.opMod), (Op.SET, self.opSet), (Op.MOVE, self.opMove),
+            (Op.GOTO, self.opGoto), (Op.MOVE_LEFT, self.opMoveLeft), (Op.MOVE_RIGHT, self.opMoveRight),
+            (Op.IF, self.opIf), (Op.STATE, self.opState), (Op.NOP, self.opNop),
+            (Op.ARRAY_FILL, self.opArrayFill), (Op.ARRAY_SCALE, self.opArrayScale),
+            (Op.MOD_REDUCE_CARRY, self.opModReduceCarry),
+        ]:
+            self.dispatch[op] = handler
         self.state = "start"
         self.headPos = 0
         self.head = None
-        self.tape = []
+        # Tape storage backend (see tapes.py)
+        self.TAPE = TAPE
+        self.tape = tapes.new_tape(TAPE)
 
         self.currInstruction = 0
-        self.variables = turing_machine['tape_markers']
 
         # --------------------------------------------------------------------------------
         #                    PARAMETERS
@@ -22,166 +64,389 @@ class HigherLevelTM:
         self.SPEED = SPEED
         # Wether or not to display visuals
         self.VISUALS = VISUALS
-
+        # Batch mode: no sleeping, no visuals and no output unless a tracer is passed in
+        self.BATCH = BATCH
+        if BATCH:
+            self.SPEED = 0
+            self.VISUALS = False
+
+        # Tracing hooks (see tracers.py), interactive runs print like they always did
+        if tracer is None and not BATCH:
+            tracer = PrintTracer()
+        self.tracer = tracer
+
+        # Run statistics (cumulative over every run() of this machine)
+        self.steps = 0
+        self.elapsed = 0.0
+        self.displayStarted = False
+
+        # Auto checkpointing (see enableAutoCheckpoint)
+        self.checkpointPath = None
+        self.checkpointEvery = 0
+        self.sinceCheckpoint = 0
 
         # Initialize visual display
-        if VISUALS: self.visual = VisualTM(SPEED)
-
-    def read_instruction(self, instruction):
-        print(instruction)
-        type = instruction.split()[0]
-        parameters = []
-        
-
-        if len(instruction.split()) > 1: 
-            for parameter in instruction.split()[1:]:
-                parameters.append(parameter)
-
-        # FOR ALL THESE INSTRUCTIONS, value can be either an integer or a variable name <--- IMPORTANT
-        match type:
-            # Reads value at head position into "head" variable
-            case "READ":
-                self.head = self.tape[self.headPos]
-
-            # Adds value to head position (ADD <value>) or variable (ADD <var> <value>)
-            case "ADD": 
-                if len(parameters) == 1:
-                    self.tape[self.headPos] += self.readValue(parameters[0])
-                else:
-                    self.tape[self.variables[parameters[0]]] += self.readValue(parameters[1])
-
-            # Subtracts value from head position (SUB <value>) or variable (SUB <var> <value>)
-            case "SUB": 
-                if len(parameters) == 1:
-                    self.tape[self.headPos] -= self.readValue(parameters[0])
-                else:
-                    self.tape[self.variables[parameters[0]]] -= self.readValue(parameters[1])
-
-            # Multiplies head position by value (MUL <value>)
-            case "MUL": 
-                if len(parameters) == 1:
-                    self.tape[self.headPos] *= self.readValue(parameters[0])
-                else:
-                    self.tape[self.variables[parameters[0]]] *= self.readValue(parameters[1])
+        if self.VISUALS: self.visual = VisualTM(SPEED)
 
-            # Devides head position by value (MUL <value>)
-            case "DIV": 
-                if len(parameters) == 1:
-                    self.tape[self.headPos] //= self.readValue(parameters[0])
-                else:
-                    self.tape[self.variables[parameters[0]]] //= self.readValue(parameters[1])
+    # Everything that comes from the macro itself (also used by extendRun to switch macros)
+    def loadMacro(self, turing_machine):
+        self.name = turing_machine.get("name", "")
+        self.fingerprint = checkpoint.macro_fingerprint(turing_machine)
+        self.params = turing_machine.get("params", {})
+        self.instructions = turing_machine["instructions"]
+        self.variables = turing_machine['tape_markers']
+        # Decoded once at load time, this is what actually gets executed
+        self.program = compile_instructions(turing_machine)
+        self.fusedLoops = {}
+        if self.FUSE_LOOPS:
+            self.program, self.fusedLoops = loop_fusion.fuse_loops(self.program)
+        self.compiled = codegen_engine.compile_engine(self.program) if self.ENGINE == COMPILED else None
+        self.vm = flat_vm.FlatVM(self, self.program) if self.ENGINE == VM else None
+
+    def execute(self, instruction):
+        if self.tracer is not None:
+            self.tracer.instruction(self, instruction)
+        self.dispatch[instruction.op](instruction)
+
+    # --------------------------------------------------------------------------------
+    #                    INSTRUCTIONS
+    # --------------------------------------------------------------------------------
+    # FOR ALL THESE INSTRUCTIONS, value can be either an integer or a variable name <--- IMPORTANT
+    # (operands are already resolved by instruction_compiler, see readValue)
+
+    # Reads value at head position into "head" variable
+    def opRead(self, instruction):
+        self.head = self.tape[self.headPos]
+
+    # Adds value to head position (ADD <value>) or variable (ADD <var> <value>)
+    def opAdd(self, instruction):
+        if instruction.target is None:
+            self.tape[self.headPos] += self.readValue(instruction.value)
+        else:
+            self.tape[instruction.target] += self.readValue(instruction.value)
+
+    # Subtracts value from head position (SUB <value>) or variable (SUB <var> <value>)
+    def opSub(self, instruction):
+        if instruction.target is None:
+            self.tape[self.headPos] -= self.readValue(instruction.value)
+        else:
+            self.tape[instruction.target] -= self.readValue(instruction.value)
+
+    # Multiplies head position by value (MUL <value>) or variable (MUL <var> <value>)
+    def opMul(self, instruction):
+        if instruction.target is None:
+            self.tape[self.headPos] *= self.readValue(instruction.value)
+        else:
+            self.tape[instruction.target] *= self.readValue(instruction.value)
+
+    # Devides head position by value (DIV <value>) or variable (DIV <var> <value>)
+    def opDiv(self, instruction):
+        if instruction.target is None:
+            self.tape[self.headPos] //= self.readValue(instruction.value)
+        else:
+            self.tape[instruction.target] //= self.readValue(instruction.value)
+
+    # Modulo head position by value (MOD <value>)
+    def opMod(self, instruction):
+        self.tape[self.headPos] %= self.readValue(instruction.value)
+
+    # Sets head position to value (SET <value>) or variable (SET <var> <value>)
+    def opSet(self, instruction):
+        if instruction.target is None:
+            self.tape[self.headPos] = self.readValue(instruction.value)
+        else:
+            value = self.readValue(instruction.value)
+            self.checkArrSize(instruction.target)
+            self.tape[instruction.target] = value
+
+    # Move head to position (index)
+    def opMove(self, instruction):
+        self.headPos = self.readValue(instruction.value)
+        self.checkArrSize(self.headPos)
+
+        self.updateDisplay() # BAO
+
+    # Move head to location of specific variable/marker
+    def opGoto(self, instruction):
+        self.headPos = instruction.target
+        self.checkArrSize(self.headPos)
+
+        self.updateDisplay() # BAO
+
+    # Move left by 1 (MOVE_LEFT) or move left by value (MOVE_LEFT <value>)
+    def opMoveLeft(self, instruction):
+        if instruction.value is None:
+            self.headPos -= 1
+            self.checkArrSize(self.headPos)
+        else:
+            self.headPos -= self.readValue(instruction.value)
+
+        self.updateDisplay() # BAO
+
+    # Move right by 1 (MOVE_RIGHT) or move right by value (MOVE_RIGHT <value>)
+    def opMoveRight(self, instruction):
+        if instruction.value is None:
+            self.headPos += 1
+            self.checkArrSize(self.headPos)
+        else:
+            self.headPos += self.readValue(instruction.value)
+
+        self.updateDisplay() # BAO
+
+    # Conditional statements (IF <value1> <compare type> <value2> <instruction>)
+    def opIf(self, instruction):
+        if instruction.compare(self.readValue(instruction.left), self.readValue(instruction.value)):
+            self.execute(instruction.body)
+
+    # Change state (STATE <new state>)
+    def opState(self, instruction):
+        self.state = instruction.target
+        self.currInstruction = -1  # Will be incremented to 0 after this function
+
+        if self.tracer is not None:
+            self.tracer.state(self)
+
+    # Unknown instructions are skipped
+    def opNop(self, instruction):
+        pass
+
+    # Superinstructions, a whole array loop in one step. The head doesn't move.
+    # Set every cell from <start> to <end> (inclusive) to value (ARRAY_FILL <start> <end> <value>)
+    def opArrayFill(self, instruction):
+        value = self.readValue(instruction.value)
+        self.checkArrSize(instruction.end)
+        kernels.fill(self.tape, instruction.target, instruction.end + 1, value)
+
+    # Multiply every cell from <start> to <end> (inclusive) by value (ARRAY_SCALE <start> <end> <value>)
+    def opArrayScale(self, instruction):
+        factor = self.readValue(instruction.value)
+        self.checkArrSize(instruction.end)
+        kernels.scale(self.tape, instruction.target, instruction.end + 1, factor)
+
+    # The spigot's mod reduction with carry from the head cell leftwards while i > 0 (MOD_REDUCE_CARRY <i> <q> <d>),
+    # leaves everything exactly like STAGE_4_MOD_LOOP does, see kernels.mod_reduce_carry
+    def opModReduceCarry(self, instruction):
+        kernels.run_mod_reduce_carry(self, *instruction.target)
+        self.updateDisplay() # BAO
 
-            # Modulo head position by value (MOD <value>)
-            case "MOD":
-                self.tape[self.headPos] %= self.readValue(parameters[0])
 
-            # Sets head position to value (SET <value>) or variable (SET <var> <value>)
-            case "SET":
-                if len(parameters) == 1:
-                    self.tape[self.headPos] = self.readValue(parameters[0])
-                else:
-                    self.setVar(parameters[0], self.readValue(parameters[1]))
-
-            # Move head to position (index)
-            case "MOVE":
-                self.headPos = self.readValue(parameters[0])
-                self.checkArrSize(self.headPos)
-
-                self.updateDisplay() # BAO
-            
-            # Move head to location of specific variable/marker
-            case "GOTO":
-                self.headPos = self.variables[parameters[0]]
-                self.checkArrSize(self.headPos)
-
-                self.updateDisplay() # BAO
-
-            # Move left by 1 (MOVE_LEFT) or move left by value (MOVE_LEFT <value>)
-            case "MOVE_LEFT":
-                if len(parameters) == 0:
-                    self.headPos -= 1
-                    self.checkArrSize(self.headPos)
-                else:
-                    self.headPos -= self.readValue(parameters[0])
-                
-                self.updateDisplay() # BAO
-            
-            # Move right by 1 (MOVE_RIGHT) or move right by value (MOVE_LEFT <value>)
-            case "MOVE_RIGHT":
-                if len(parameters) == 0:
-                    self.headPos += 1
-                    self.checkArrSize(self.headPos)
+    # Main loop of executing instructions
+    # Runs until ACCEPT or until budget more instructions have been executed (None = no limit).
+    # The machine keeps its state, so calling run() again continues where the last run paused.
+    def run(self, budget=None) -> RunResult:
+        totalExecuted = 0
+        limit = float("inf") if budget is None else budget
+        started = time.perf_counter()
+
+        if not self.displayStarted:
+            self.initiateDisplay()
+            self.displayStarted = True
+
+        while self.state != "ACCEPT" and totalExecuted < limit:
+            # Run in slices that end on the next auto checkpoint, so the hot loop itself never checks for it
+            sliceSize = limit - totalExecuted
+            if self.checkpointEvery:
+                sliceSize = min(sliceSize, self.checkpointEvery - self.sinceCheckpoint)
+
+            executed = self.runSlice(sliceSize)
+            totalExecuted += executed
+            self.steps += executed
+
+            if self.checkpointEvery:
+                self.sinceCheckpoint += executed
+                if self.sinceCheckpoint >= self.checkpointEvery:
+                    self.saveCheckpoint(self.checkpointPath)
+
+        elapsed = time.perf_counter() - started
+        self.elapsed += elapsed
+        if self.tracer is not None:
+            self.tracer.finished(self)
+
+        if self.state == "ACCEPT":
+            return RunResult(ACCEPTED, totalExecuted, self.steps, elapsed, self.getOutput())
+        return RunResult(OUT_OF_BUDGET, totalExecuted, self.steps, elapsed, None)
+
+    # Executes up to limit instructions, returns how many were executed
+    def runSlice(self, limit):
+        totalExecuted = 0
+        program = self.program
+        dispatch = self.dispatch
+
+        while True:
+            try:
+                if self.vm is not None and self.BATCH and self.tracer is None:
+                    # The flat VM keeps its own pc and promotes the tape itself, see flat_vm.py
+                    return totalExecuted + self.vm.run(limit - totalExecuted)
+                elif self.compiled is not None and self.BATCH and self.tracer is None and \
+                        not isinstance(self.tape, tapes.PagedTape):
+                    # Whole states at once in compiled code. A state can't be retried halfway through,
+                    # so the tape is promoted up front instead of on overflow. The generated code grows
+                    # the tape with dense zeros, so paged tapes stay with the interpreter.
+                    if tapes.can_promote(self.tape):
+                        self.tape = tapes.promote(self.tape)
+                    while(self.state != "ACCEPT" and totalExecuted < limit):
+                        if self.currInstruction == 0:
+                            totalExecuted += self.compiled(self, limit - totalExecuted)
+                            if self.state == "ACCEPT" or totalExecuted >= limit:
+                                break
+                        # Single steps when resuming mid state or when the next state doesn't fit the budget
+                        instruction = program[self.state][self.currInstruction]
+                        if instruction.op is FUSED:
+                            totalExecuted += self.runFused(instruction, limit - totalExecuted)
+                        else:
+                            dispatch[instruction.op](instruction)
+                            totalExecuted += 1
+                        self.currInstruction += 1
+                elif self.BATCH and self.tracer is None and not self.fusedLoops:
+                    # Fast path, nothing to print, trace or wait for
+                    while(self.state != "ACCEPT" and totalExecuted < limit):
+                        instruction = program[self.state][self.currInstruction]
+                        dispatch[instruction.op](instruction)
+                        self.currInstruction += 1
+
+                        totalExecuted += 1
+                elif self.BATCH and self.tracer is None:
+                    # Same with fused loops, those account for many instructions at once
+                    while(self.state != "ACCEPT" and totalExecuted < limit):
+                        instruction = program[self.state][self.currInstruction]
+                        if instruction.op is FUSED:
+                            totalExecuted += self.runFused(instruction, limit - totalExecuted)
+                        else:
+                            dispatch[instruction.op](instruction)
+                            totalExecuted += 1
+                        self.currInstruction += 1
                 else:
-                    self.headPos += self.readValue(parameters[0])
-                
-                self.updateDisplay() # BAO
-            
-            # Conditional statements (IF <value1> <compare type> <value2> <instruction>)
-            case "IF":
-                value1 = self.readValue(parameters[0])
-                value2 = self.readValue(parameters[2])
-                boolean = parameters[1]
-
-                match boolean:
-                    case "==":
-                        if value1 == value2:
-                            instruction = " ".join(parameters[3:])
-                            self.read_instruction(instruction)
-                    
-                    case "!=":
-                        if value1 != value2:
-                            instruction = " ".join(parameters[3:])
-                            self.read_instruction(instruction)
-                    
-                    case "<=":
-                        if value1 <= value2:
-                            instruction = " ".join(parameters[3:])
-                            self.read_instruction(instruction)
-                    
-                    case ">=":
-                        if value1 >= value2:
-                            instruction = " ".join(parameters[3:])
-                            self.read_instruction(instruction)
-                    
-                    case "<":
-                        if value1 < value2:
-                            instruction = " ".join(parameters[3:])
-                            self.read_instruction(instruction)
-                    
-                    case ">":
-                        if value1 > value2:
-                            instruction = " ".join(parameters[3:])
-                            self.read_instruction(instruction)
-            # Change state (STATE <new state>)
-            case "STATE": 
-                self.state = parameters[0]
-                self.currInstruction = -1  # Will be incremented to 0 after this function
-                
-                # print(self.tape[self.variables["OUTPUT"]:self.variables["WORK"]])
-                print(self.tape) # <------------------------------------------------------------ PRINT TAPE
+                    while(self.state != "ACCEPT" and totalExecuted < limit):
+
+                        instruction = self.getInstruction()
+                        if instruction.op is FUSED:
+                            if self.tracer is not None:
+                                self.tracer.instruction(self, instruction)
+                            totalExecuted += self.runFused(instruction, limit - totalExecuted)
+                        else:
+                            self.execute(instruction)
+                            totalExecuted += 1
+                        # self.updateDisplay() # BAO
+                        self.currInstruction += 1
+
+                        if self.SPEED:
+                            time.sleep(self.SPEED)
+
+                return totalExecuted
+
+            except (OverflowError, TypeError):
+                # A value didn't fit the compact tape. Writing is the last thing an instruction does,
+                # so nothing has changed yet: switch to big int storage and run the same instruction again.
+                if not tapes.can_promote(self.tape):
+                    raise
+                self.tape = tapes.promote(self.tape)
+
+    # Runs a fused loop (instruction.target) as one kernel call and returns how many instructions
+    # that stands for. If the kernel can't run this time the original first instruction of the state runs.
+    def runFused(self, instruction, budget):
+        steps = instruction.target.run(self, budget)
+        if steps:
+            self.updateDisplay() # BAO
+            return steps
+
+        self.execute(instruction.body)
+        return 1
+
+    # --------------------------------------------------------------------------------
+    #                    CHECKPOINTS (format in checkpoint.py)
+    # --------------------------------------------------------------------------------
+    def saveCheckpoint(self, path):
+        checkpoint.save_checkpoint(self, path)
+        self.sinceCheckpoint = 0
+
+    # The machine has to be built from the same macro the checkpoint was taken from
+    def loadCheckpoint(self, path):
+        checkpoint.load_checkpoint(self, path)
+        self.sinceCheckpoint = 0
+
+    # Save to path every `every` steps while running (every=0 turns it off)
+    def enableAutoCheckpoint(self, path, every):
+        self.checkpointPath = path
+        self.checkpointEvery = every
+        self.sinceCheckpoint = 0
+
+    # --------------------------------------------------------------------------------
+    #                    EXTENDING A FINISHED RUN
+    # --------------------------------------------------------------------------------
+    # Continue an accepted pi spigot run with a macro that asks for more digits, instead of starting over.
+    # The spigot's array length is fixed by the number of digits it is sized for: an array of
+    # ceil(10n/3) cells only holds n correct digits, and the remainders in it depend on that length,
+    # so they can't be carried over to a longer array. Reuse therefore only works between macros with
+    # the same array, i.e. generate_pi_tm_macro(n, capacity=C) for the first run and
+    # generate_pi_tm_macro(m, capacity=C) with n <= m <= C to extend it. Anything else raises ValueError.
+    # OUTPUT may grow (WORK and the variables behind it move right), the result is then exactly the
+    # tape a fresh run of the new macro ends with.
+    def extendRun(self, turing_machine):
+        if self.state != "ACCEPT":
+            raise ValueError(f"only a finished run can be extended, the machine is in state {self.state}")
+        if "STAGE_2_MAIN_LOOP" not in turing_machine["instructions"]:
+            raise ValueError(f"{turing_machine.get('name', '')} isn't a pi spigot macro, nothing to resume")
+
+        old, new = self.variables, turing_machine["tape_markers"]
+        for marker in ("START", "LEN", "ARRAY", "ARRAY_END", "PREDIGIT", "NINES", "OUTPUT"):
+            if old.get(marker) != new.get(marker):
+                raise ValueError(
+                    f"can't extend {self.name} with {turing_machine.get('name', '')}: {marker} is at {old.get(marker)} "
+                    f"vs {new.get(marker)}. The spigot array can't change length mid run, generate both macros "
+                    f"with the same capacity (generate_pi_tm_macro(n, capacity=C))"
+                )
+        oldWork, newWork = old["WORK"], new["WORK"]
+        if newWork < oldWork:
+            raise ValueError(f"the OUTPUT section can't shrink (WORK {oldWork} -> {newWork})")
+        for marker, position in old.items():
+            if position >= oldWork and new.get(marker) != position + newWork - oldWork:
+                raise ValueError(f"{marker} has to keep its place relative to WORK")
+        # The digit flushes stop when OUTPUT is full and drop the rest of the buffered digits
+        if self.tape[old["COUNTER"]] >= oldWork - old["OUTPUT"]:
+            raise ValueError("the OUTPUT section of this run filled up, buffered digits may have been dropped")
+
+        # Move WORK and the variables after it, the new OUTPUT cells start out as zeros
+        shift = newWork - oldWork
+        if shift:
+            cells = list(self.tape)
+            self.tape = tapes.new_tape(self.TAPE, cells[:oldWork] + tapes.zeros(shift) + cells[oldWork:])
+            if self.headPos >= oldWork:
+                self.headPos += shift
+
+        self.loadMacro(turing_machine)
+        # STAGE_2 is where the old run decided it had enough digits, the finalize it did only wrote
+        # the held predigit to OUTPUT, which gets written again once the run gets there
+        self.state = "STAGE_2_MAIN_LOOP"
+        self.currInstruction = 0
 
+    # Runs the machine and returns the output (budget works like in run())
+    def executeInstructions(self, budget=None):
+        result = self.run(budget)
+        if result.status == OUT_OF_BUDGET:
+            print(f"warning: instruction budget used up after {result.total_steps} steps in state {self.state}, output is incomplete")
 
-    # Main loop of executing instructions
-    def executeInstructions(self):
-        totalExecuted = 0
+        return self.getOutput()
 
-        self.initiateDisplay()
-        while(self.state != "ACCEPT" and totalExecuted <= self.INSTRUCTION_LIMIT ):
-            
-            self.read_instruction(self.getInstruction())
-            # self.updateDisplay() # BAO
-            self.currInstruction += 1
-            
-            totalExecuted += 1
-            time.sleep(self.SPEED)
+    def getOutput(self):
+        if "OUTPUT" not in self.variables or "WORK" not in self.variables: # not a pi macro
+            return None
 
+        end = self.variables["WORK"]
+        if "n_digits" in self.params: # OUTPUT can be bigger than asked for (see generate_pi_tm_macro capacity)
+            end = min(end, self.variables["OUTPUT"] + self.params["n_digits"])
+        digits = self.tape[self.variables["OUTPUT"]+1:end]
+        if len(digits) == 0: # haven't got that far yet
+            return ""
 
-        output = str(self.tape[self.variables["OUTPUT"]+1]) + '.'
-        for char in self.tape[self.variables["OUTPUT"]+2:self.variables["WORK"]]:
+        output = str(digits[0]) + '.'
+        for char in digits[1:]:
             output += str(char)
 
         return output
 
+    def stepsPerSecond(self):
+        return self.steps / self.elapsed if self.elapsed > 0 else 0.0
+
     def getVar(self, varName):
         return self.tape[self.variables[varName]]
     
@@ -190,23 +455,22 @@ class HigherLevelTM:
         self.tape[self.variables[varName]] = value
 
     def checkArrSize(self, position): # make sure the array is big enough for location
-        arrSize = len(self.tape)
-        if position >= arrSize:
-            self.tape.extend([0]*(position - arrSize + 1))
+        if position >= len(self.tape):
+            tapes.grow(self.tape, position)
 
     def getInstruction(self):
         # if self.currInstruction >= len(self.instructions[self.state]):
         #     self.currInstruction = 0
-        return self.instructions[self.state][self.currInstruction]
-        
-
-    def readValue(self, value) -> int:
-        if value.isnumeric():
-            return int(value)
-        
-        elif value in self.variables.keys():
-            return self.getVar(value)
-        elif value == "HEAD":
+        return self.program[self.state][self.currInstruction]
+
+
+    def readValue(self, operand) -> int:
+        kind, value = operand
+        if kind is LITERAL:
+            return value
+        elif kind is MARKER:
+            return self.tape[value]
+        elif kind is HEAD:
             return self.head
 
     def initiateDisplay(self): # BAO
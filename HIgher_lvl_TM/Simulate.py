@@ -1,15 +1,45 @@
 import HigherLevelTM
 import json
+import os
 
 # Wait time between instructions in seconds
 # Ideal demo speed is 0.0001 to show final result
 SPEED = 0.1
 # Wether or not to display visuals
 VISUALS = True
+# Batch mode: no sleeping/visuals/per-step output, just the result and steps per second
+BATCH = False
+# Run recognized array loops as native kernels (same results, far fewer Python-level steps)
+FUSE_LOOPS = False
+# "reference" interprets one instruction at a time, "compiled" turns the macro into Python code first
+# (batch runs only, see codegen_engine.py), "vm" lowers it to a flat instruction array (see flat_vm.py)
+ENGINE = "reference"
+# With ENGINE = "vm": count steps per state and instruction and print them after the run
+PROFILE = False
+# Tape backend: "int64" (packed array), "list" (plain Python ints) or "paged" (sparse, allocated per page)
+TAPE = "int64"
+# Max number of instructions to execute (None = run until ACCEPT)
+BUDGET = None
+# Checkpoint file to resume from/save to every CHECKPOINT_EVERY steps (None = no checkpoints)
+CHECKPOINT = None
+CHECKPOINT_EVERY = 1000000
 
 if __name__ == "__main__":
     with open('TM_instructions.json', 'r') as f:
         tm_macro = json.load(f)
 
-    turingMachine = HigherLevelTM.HigherLevelTM(tm_macro, SPEED, VISUALS)
-    print(turingMachine.executeInstructions())
\ No newline at end of file
+    turingMachine = HigherLevelTM.HigherLevelTM(tm_macro, SPEED, VISUALS, BATCH, TAPE=TAPE, FUSE_LOOPS=FUSE_LOOPS, ENGINE=ENGINE)
+    if PROFILE and turingMachine.vm is not None:
+        turingMachine.vm.profile = True
+    if CHECKPOINT is not None:
+        if os.path.exists(CHECKPOINT):
+            turingMachine.loadCheckpoint(CHECKPOINT)
+            print(f"resumed from {CHECKPOINT} at step {turingMachine.steps}")
+        turingMachine.enableAutoCheckpoint(CHECKPOINT, CHECKPOINT_EVERY)
+
+    print(turingMachine.executeInstructions(BUDGET))
+
+    if BATCH:
+        print(f"{turingMachine.steps} steps in {turingMachine.elapsed:.3f}s ({turingMachine.stepsPerSecond():,.0f} steps/sec)")
+    if PROFILE and turingMachine.vm is not None:
+        print(turingMachine.vm.report())
@@ -0,0 +1,177 @@
+"""
+Differential check for the spigot's carry loop
+
+STAGE_4_MOD_LOOP can run three ways: interpreted one instruction at a time, as the MOD_REDUCE_CARRY
+superinstruction (kernels.run_mod_reduce_carry) or as a fused CarryLoop (loop_fusion.py). All three
+have to leave the tape, the head position and HEAD bit for bit the same, the fused loop also the
+same number of steps. check() runs the state on random tapes in every way and compares, including
+the cases the kernel hands to its exact fallback:
+
+    plain     the variables sit left of the swept cells, the fast path
+    aliased   a variable sits inside the swept cells
+    wrap      i is bigger than the head position, the head walks past cell 0 and Python indexing
+              wraps around to the end of the tape
+    i <= 0    the loop is entered with i <= 0 and makes its one pass
+    overflow  the carries don't fit in 64 bits, int64 tapes get promoted halfway
+
+Near misses (the same state with one instruction changed) must either not be fused or give the same
+result as the interpreter:
+
+    python check_kernels.py --cases 200
+"""
+import argparse
+import random
+
+import HigherLevelTM
+import tapes
+
+MOD_LOOP = [
+    "READ",
+    "SET q HEAD",
+    "SET d i",
+    "MUL d 2",
+    "ADD d 1",
+    "MOD d",
+    "DIV q d",
+    "MUL q i",
+    "SUB i 1",
+    "MOVE_LEFT",
+    "ADD q",
+    "IF i <= 0 STATE ACCEPT",
+    "STATE MOD_LOOP",
+]
+SUPERINSTRUCTION = ["MOD_REDUCE_CARRY i q d", "STATE ACCEPT"]
+# (index in MOD_LOOP, replacement), each one changes what the state computes
+NEAR_MISSES = [
+    (1, "SET q d"),
+    (2, "ADD d i"),
+    (2, "MUL d i"),
+    (2, "SET d q"),
+    (3, "MUL d 3"),
+    (4, "SUB d 1"),
+    (6, "MOD q d"),
+    (7, "MUL q d"),
+    (8, "SUB i 2"),
+    (9, "MOVE_RIGHT"),
+    (10, "SUB q"),
+]
+KINDS = ("plain", "aliased", "wrap", "i <= 0", "overflow")
+TAPES = (tapes.LIST, tapes.INT64)
+
+
+def make_case(kind, rng):
+    """
+    Random start configuration of the given kind.
+
+    Returns:
+        tuple: (cells, {variable: address}, head position).
+    """
+    # the swept cells, the head on the last one, then i, q, d and some cells the head wraps around to
+    n = rng.randint(3, 40)
+    big = kind == "overflow"
+    cells = [rng.randint(2 ** 61, 2 ** 62) if big else rng.randint(0, 10 ** 6) for _ in range(n + 11)]
+    head = n - 1
+    markers = {"i": n, "q": n + 1, "d": n + 2}
+    if kind == "plain" or kind == "overflow":
+        cells[n] = rng.randint(1, n - 1)
+    elif kind == "aliased":
+        cells[n] = rng.randint(2, n - 1)
+        markers[rng.choice(["q", "d"])] = head - rng.randint(0, cells[n] - 1)
+    elif kind == "wrap":
+        cells[n] = rng.randint(head + 2, head + 8)
+    else:
+        cells[n] = rng.randint(-3, 0)
+    return cells, markers, head
+
+
+def run(state, cells, markers, head, tape, fuse=False):
+    """
+    Run state from a start configuration until it accepts.
+
+    Returns:
+        tuple: (machine, steps).
+    """
+    macro = {"name": "check", "tape_markers": markers, "instructions": {"MOD_LOOP": state}}
+    tm = HigherLevelTM.HigherLevelTM(macro, 0, False, BATCH=True, TAPE=tape, FUSE_LOOPS=fuse)
+    tm.tape = tapes.new_tape(tape, cells)
+    tm.headPos = head
+    tm.state = "MOD_LOOP"
+    return tm, tm.run().steps
+
+
+def configuration(tm) -> tuple:
+    return list(tm.tape), tm.headPos, tm.head
+
+
+def check_case(kind, tape, rng) -> list:
+    """
+    Run one random case of a kind on a tape backend every way.
+
+    Returns:
+        list: Descriptions of the mismatches (empty = everything agreed).
+    """
+    for _ in range(100):
+        cells, markers, head = make_case(kind, rng)
+        try:
+            interpreted, steps = run(MOD_LOOP, cells, markers, head, tape)
+            break
+        except ZeroDivisionError:
+            pass  # an aliased d got reduced to 0, the state itself can't run on this tape
+    else:
+        return [f"{kind}/{tape}: no case the interpreter can run"]
+    errors = []
+    fused, fused_steps = run(MOD_LOOP, cells, markers, head, tape, fuse=True)
+    superinstruction, _ = run(SUPERINSTRUCTION, cells, markers, head, tape)
+    if not fused.fusedLoops:
+        errors.append(f"{kind}/{tape}: MOD_LOOP wasn't fused")
+    if configuration(fused) != configuration(interpreted) or fused_steps != steps:
+        errors.append(f"{kind}/{tape}: fused CarryLoop differs from the interpreter (cells {cells}, markers {markers})")
+    if configuration(superinstruction) != configuration(interpreted):
+        errors.append(f"{kind}/{tape}: MOD_REDUCE_CARRY differs from the interpreter (cells {cells}, markers {markers})")
+
+    for index, replacement in NEAR_MISSES:
+        state = MOD_LOOP[:index] + [replacement] + MOD_LOOP[index + 1:]
+        try:
+            expected = run(state, cells, markers, head, tape)
+        except (ZeroDivisionError, IndexError):
+            continue  # the changed state doesn't run on this tape, nothing to compare
+        machine, fused_steps = run(state, cells, markers, head, tape, fuse=True)
+        if configuration(machine) != configuration(expected[0]) or fused_steps != expected[1]:
+            errors.append(f"{kind}/{tape}: '{replacement}' in place of '{MOD_LOOP[index]}' fused differently")
+    return errors
+
+
+def check(cases, seed=0) -> list:
+    """
+    Run cases random cases of every kind on every tape backend.
+
+    Returns:
+        list: Descriptions of the mismatches (empty = everything agreed).
+    """
+    rng = random.Random(seed)
+    errors = []
+    for kind in KINDS:
+        for tape in TAPES:
+            for _ in range(cases):
+                errors += check_case(kind, tape, rng)
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the carry loop interpreted, as MOD_REDUCE_CARRY and fused")
+    parser.add_argument("--cases", type=int, default=50, help="random cases per kind and tape backend")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    errors = check(args.cases, args.seed)
+    for error in errors[:20]:
+        print(error)
+    total = args.cases * len(KINDS) * len(TAPES)
+    print(f"{total} cases ({', '.join(KINDS)} on {', '.join(TAPES)} tapes): "
+          f"{'all agree' if not errors else f'{len(errors)} MISMATCHES'}")
+    if errors:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
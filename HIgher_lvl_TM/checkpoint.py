@@ -0,0 +1,215 @@
+"""
+Binary checkpoints of a HigherLevelTM machine so long runs can be resumed
+
+Layout (little endian):
+    header   "HLTMCKPT", format version (u16), macro fingerprint (32 bytes, sha256)
+    strings  macro name, current state (u32 length + utf-8)
+    numbers  currInstruction, headPos (i64), steps (u64), elapsed seconds (f64), head (value, see below)
+    tape     encoding (u8), cell count (u64), cells
+
+Tape encodings:
+    0  every cell fits in a signed 64 bit int, cells are packed with array('q')
+    1  anything else (big ints or None), every cell is written as a value
+    2  PagedTape (version 2+): page bits (u8), length, lowest cell (i64), page count (u64), then per
+       allocated page its number (i64) and its cells as encoding 0 or 1 (u8, cell count u64, cells)
+
+Values are a tag (u8: 0 = None, 1 = int) followed for ints by a byte length (u32) and the
+two's complement bytes.
+"""
+import hashlib
+import json
+import os
+import struct
+import sys
+from array import array
+
+import tapes
+
+MAGIC = b"HLTMCKPT"
+VERSION = 2
+# Versions load_checkpoint can read, 1 is the same format without paged tapes
+READABLE_VERSIONS = (1, 2)
+
+TAPE_INT64 = 0
+TAPE_VALUES = 1
+TAPE_PAGED = 2
+
+INT64_MIN = -2**63
+INT64_MAX = 2**63 - 1
+
+
+def macro_fingerprint(turing_machine) -> bytes:
+    """
+    Identify a macro by its instructions and tape layout, so a checkpoint can't be loaded into a different program.
+
+    Args:
+        turing_machine: TM macro description.
+
+    Returns:
+        bytes: sha256 digest.
+    """
+    identity = json.dumps(
+        {"instructions": turing_machine["instructions"], "tape_markers": turing_machine["tape_markers"]},
+        sort_keys=True,
+    )
+    return hashlib.sha256(identity.encode("utf-8")).digest()
+
+
+def _write_string(f, text):
+    data = text.encode("utf-8")
+    f.write(struct.pack("<I", len(data)))
+    f.write(data)
+
+
+def _read_string(f):
+    (length,) = struct.unpack("<I", _read_exact(f, 4))
+    return _read_exact(f, length).decode("utf-8")
+
+
+def _write_value(f, value):
+    if value is None:
+        f.write(struct.pack("<B", 0))
+        return
+    data = value.to_bytes((value.bit_length() + 8) // 8, "little", signed=True)
+    f.write(struct.pack("<BI", 1, len(data)))
+    f.write(data)
+
+
+def _read_value(f):
+    (tag,) = struct.unpack("<B", _read_exact(f, 1))
+    if tag == 0:
+        return None
+    (length,) = struct.unpack("<I", _read_exact(f, 4))
+    return int.from_bytes(_read_exact(f, length), "little", signed=True)
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("checkpoint file is truncated")
+    return data
+
+
+def _fits_int64(cells):
+    for cell in cells:
+        if type(cell) is not int or cell < INT64_MIN or cell > INT64_MAX:
+            return False
+    return True
+
+
+def _write_cells(f, cells):
+    if _fits_int64(cells):
+        packed = array("q", cells)
+        if sys.byteorder != "little":
+            packed.byteswap()
+        f.write(struct.pack("<BQ", TAPE_INT64, len(packed)))
+        f.write(packed.tobytes())
+    else:
+        f.write(struct.pack("<BQ", TAPE_VALUES, len(cells)))
+        for cell in cells:
+            _write_value(f, cell)
+
+
+def _read_cells(f, encoding, count):
+    if encoding == TAPE_INT64:
+        packed = array("q")
+        packed.frombytes(_read_exact(f, 8 * count))
+        if sys.byteorder != "little":
+            packed.byteswap()
+        return packed
+    elif encoding == TAPE_VALUES:
+        return [_read_value(f) for _ in range(count)]
+    raise ValueError(f"unknown tape encoding {encoding}")
+
+
+def _read_paged(f):
+    page_bits, length, lowest, count = struct.unpack("<BqqQ", _read_exact(f, 25))
+    tape = tapes.PagedTape(page_bits=page_bits)
+    for _ in range(count):
+        (number,) = struct.unpack("<q", _read_exact(f, 8))
+        encoding, cells = struct.unpack("<BQ", _read_exact(f, 9))
+        if cells != tape.page_size:
+            raise ValueError(f"page {number} has {cells} cells, expected {tape.page_size}")
+        tape.pages[number] = list(_read_cells(f, encoding, cells))
+    tape.length = length
+    tape.lowest = lowest
+    return tape
+
+
+def save_checkpoint(tm, path):
+    """
+    Write the full machine state to path. The file is replaced atomically so a crash mid-write keeps the old one.
+
+    Args:
+        tm: HigherLevelTM machine.
+        path: Checkpoint file to write.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<H", VERSION))
+        f.write(tm.fingerprint)
+        _write_string(f, tm.name)
+        _write_string(f, tm.state)
+        f.write(struct.pack("<qqQd", tm.currInstruction, tm.headPos, tm.steps, tm.elapsed))
+        _write_value(f, tm.head)
+
+        tape = tm.tape
+        if isinstance(tape, tapes.PagedTape):
+            # only the allocated pages, a sparse tape stays small on disk too
+            f.write(struct.pack("<BBqqQ", TAPE_PAGED, tape.page_bits, tape.length, tape.lowest, len(tape.pages)))
+            for number, page in sorted(tape.pages.items()):
+                f.write(struct.pack("<q", number))
+                _write_cells(f, page)
+        else:
+            _write_cells(f, tape)
+
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(tm, path):
+    """
+    Restore a machine from a checkpoint written by save_checkpoint.
+
+    Args:
+        tm: HigherLevelTM machine built from the same macro the checkpoint was taken from.
+        path: Checkpoint file to read.
+
+    Raises:
+        ValueError: If the file isn't a checkpoint, has an unknown version or belongs to a different macro.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a HigherLevelTM checkpoint")
+        (version,) = struct.unpack("<H", _read_exact(f, 2))
+        if version not in READABLE_VERSIONS:
+            raise ValueError(f"unsupported checkpoint version {version} (expected one of {READABLE_VERSIONS})")
+        fingerprint = _read_exact(f, 32)
+        name = _read_string(f)
+        if fingerprint != tm.fingerprint:
+            raise ValueError(f"checkpoint is for macro {name}, not {tm.name}")
+
+        state = _read_string(f)
+        currInstruction, headPos, steps, elapsed = struct.unpack("<qqQd", _read_exact(f, 32))
+        head = _read_value(f)
+
+        (encoding,) = struct.unpack("<B", _read_exact(f, 1))
+        if encoding == TAPE_PAGED:
+            tape = _read_paged(f)
+            if tm.TAPE != tapes.PAGED:
+                if tape.lowest < 0:
+                    raise ValueError(f"checkpoint has cells left of 0, only a {tapes.PAGED} tape can hold them")
+                tape = tapes.new_tape(tm.TAPE, tape.tolist())
+        else:
+            (count,) = struct.unpack("<Q", _read_exact(f, 8))
+            tape = tapes.new_tape(tm.TAPE, _read_cells(f, encoding, count))
+
+    tm.state = state
+    tm.currInstruction = currInstruction
+    tm.headPos = headPos
+    tm.head = head
+    tm.steps = steps
+    tm.elapsed = elapsed
+    tm.tape = tape
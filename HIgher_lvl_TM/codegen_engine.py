@@ -0,0 +1,217 @@
+"""
+Compiled execution engine for HigherLevelTM programs
+
+Turns a compiled program (see instruction_compiler, optionally after loop_fusion) into the source of a
+single Python function and builds it with compile()/exec. Every state becomes a straight-line block:
+marker addresses and literals are baked in as constants, the head position/HEAD/tape are locals,
+instruction counts are added once per exit instead of once per step, and a state that jumps back to
+itself becomes a local while loop instead of going through the state lookup again.
+
+The generated function only ever starts at the top of a state and only stops on a state boundary:
+before entering a state it checks that the whole state fits in the remaining budget, otherwise it hands
+back to the reference interpreter, which finishes the slice one instruction at a time. So budgets,
+pauses and checkpoints behave exactly like with the reference interpreter.
+"""
+import operator
+
+from instruction_compiler import Op, LITERAL, MARKER, HEAD
+import kernels
+
+SYMBOLS = {
+    operator.eq: "==",
+    operator.ne: "!=",
+    operator.le: "<=",
+    operator.ge: ">=",
+    operator.lt: "<",
+    operator.gt: ">",
+}
+
+ARITHMETIC = {
+    Op.ADD: "+=",
+    Op.SUB: "-=",
+    Op.MUL: "*=",
+    Op.DIV: "//=",
+}
+
+
+class _Generator:
+    def __init__(self, program):
+        self.program = program
+        self.ids = {}
+        self.constants = {"kernels": kernels}
+        self.lines = []
+        for state in program:
+            self._state_id(state)
+
+    def _state_id(self, state):
+        if state not in self.ids:
+            self.ids[state] = len(self.ids)
+        return self.ids[state]
+
+    def emit(self, indent, line):
+        self.lines.append("    " * indent + line)
+
+    def value(self, operand):
+        kind, value = operand
+        if kind is LITERAL:
+            return repr(value)
+        elif kind is MARKER:
+            return f"t[{value}]"
+        elif kind is HEAD:
+            return "head"
+        return "None"
+
+    def grow(self, indent, position):
+        # checkArrSize
+        self.emit(indent, f"if {position} >= len(t): t.extend([0] * ({position} - len(t) + 1))")
+
+    def jump(self, indent, state, target, count, looping):
+        self.emit(indent, f"executed += {count}")
+        if target == state and looping:
+            self.emit(indent, "continue")
+        else:
+            self.emit(indent, f"s = {self._state_id(target)}")
+            self.emit(indent, "break" if looping else "continue")
+
+    def instruction(self, indent, state, instruction, count, looping):
+        """Emit one instruction, returns True if it always leaves the state"""
+        op = instruction.op
+        if op is Op.READ:
+            self.emit(indent, "head = t[h]")
+        elif op in ARITHMETIC:
+            cell = "t[h]" if instruction.target is None else f"t[{instruction.target}]"
+            self.emit(indent, f"{cell} {ARITHMETIC[op]} {self.value(instruction.value)}")
+        elif op is Op.MOD:
+            self.emit(indent, f"t[h] %= {self.value(instruction.value)}")
+        elif op is Op.SET:
+            if instruction.target is None:
+                self.emit(indent, f"t[h] = {self.value(instruction.value)}")
+            else:
+                self.emit(indent, f"value = {self.value(instruction.value)}")
+                self.grow(indent, instruction.target)
+                self.emit(indent, f"t[{instruction.target}] = value")
+        elif op is Op.MOVE:
+            self.emit(indent, f"h = {self.value(instruction.value)}")
+            self.grow(indent, "h")
+        elif op is Op.GOTO:
+            self.emit(indent, f"h = {instruction.target}")
+            self.grow(indent, "h")
+        elif op in (Op.MOVE_LEFT, Op.MOVE_RIGHT):
+            sign = "-" if op is Op.MOVE_LEFT else "+"
+            if instruction.value is None:
+                self.emit(indent, f"h {sign}= 1")
+                self.grow(indent, "h")
+            else:
+                self.emit(indent, f"h {sign}= {self.value(instruction.value)}")
+        elif op is Op.IF:
+            left = self.value(instruction.left)
+            right = self.value(instruction.value)
+            self.emit(indent, f"if {left} {SYMBOLS[instruction.compare]} {right}:")
+            # the body runs as part of the IF's step
+            self.instruction(indent + 1, state, instruction.body, count, looping)
+        elif op is Op.STATE:
+            self.jump(indent, state, instruction.target, count, looping)
+            return True
+        elif op in (Op.ARRAY_FILL, Op.ARRAY_SCALE):
+            function = "fill" if op is Op.ARRAY_FILL else "scale"
+            self.emit(indent, f"value = {self.value(instruction.value)}")
+            self.grow(indent, instruction.end)
+            self.emit(indent, f"kernels.{function}(t, {instruction.target}, {instruction.end + 1}, value)")
+        elif op is Op.MOD_REDUCE_CARRY:
+            self.emit(indent, "tm.headPos = h")
+            self.emit(indent, f"kernels.run_mod_reduce_carry(tm, {', '.join(map(str, instruction.target))})")
+            self.emit(indent, "h = tm.headPos")
+            self.emit(indent, "head = tm.head")
+        elif op is Op.NOP:
+            self.emit(indent, "pass")
+        else:
+            raise ValueError(f"can't compile instruction '{instruction.text}'")
+        return False
+
+    def fused(self, indent, state, instruction, looping):
+        # loop_fusion kernel, falls through to the original first instruction if it can't run
+        name = f"K{self.ids[state]}"
+        self.constants[name] = instruction.target
+        self.emit(indent, "tm.headPos = h")
+        self.emit(indent, "tm.head = head")
+        self.emit(indent, f"n = {name}.run(tm, limit - executed)")
+        self.emit(indent, "if n:")
+        self.emit(indent + 1, "h = tm.headPos")
+        self.emit(indent + 1, "head = tm.head")
+        self.jump(indent + 1, state, instruction.target.exit_state, "n", looping)
+        self.instruction(indent, state, instruction.body, 1, looping)
+
+    def state(self, state, instructions):
+        looping = any(
+            (instruction.op is Op.STATE and instruction.target == state) or
+            (instruction.op is Op.IF and instruction.body.op is Op.STATE and instruction.body.target == state)
+            for instruction in instructions
+        )
+        self.emit(2, f"if s == {self.ids[state]}:  # {state}")
+        indent = 3
+        if looping:
+            self.emit(indent, "while True:")
+            indent += 1
+        self.emit(indent, f"if executed + {len(instructions)} > limit:")
+        self.emit(indent + 1, "stop = True")
+        self.emit(indent + 1, "break")
+
+        for count, instruction in enumerate(instructions, start=1):
+            if instruction.op is Op.FUSED:
+                self.fused(indent, state, instruction, looping)
+            elif self.instruction(indent, state, instruction, count, looping):
+                break
+        else:
+            # ran off the end of the state, let the reference interpreter report it
+            self.emit(indent, f"executed += {len(instructions)}")
+            self.emit(indent, f"ci = {len(instructions)}")
+            self.emit(indent, "stop = True")
+            self.emit(indent, "break")
+
+        if looping:
+            self.emit(3, "if stop:")
+            self.emit(4, "break")
+            self.emit(3, "continue")
+
+    def source(self):
+        self.emit(0, "def run(tm, limit):")
+        self.emit(1, "t = tm.tape")
+        self.emit(1, "h = tm.headPos")
+        self.emit(1, "head = tm.head")
+        self.emit(1, "executed = 0")
+        self.emit(1, "ci = 0")
+        self.emit(1, "stop = False")
+        self.emit(1, "s = IDS.get(tm.state, -1)")
+        self.emit(1, "while True:")
+        for state, instructions in self.program.items():
+            self.state(state, instructions)
+        self.emit(2, "break  # ACCEPT or a state the program doesn't have")
+        self.emit(1, "tm.headPos = h")
+        self.emit(1, "tm.head = head")
+        self.emit(1, "if s >= 0:")
+        self.emit(2, "tm.state = NAMES[s]")
+        self.emit(1, "tm.currInstruction = ci")
+        self.emit(1, "return executed")
+        return "\n".join(self.lines) + "\n"
+
+
+def compile_engine(program):
+    """
+    Build the compiled engine for a program.
+
+    Args:
+        program: Compiled program (state -> instructions), possibly with FUSED states.
+
+    Returns:
+        function: run(tm, limit) -> instructions executed. tm has to be sitting on the first instruction
+        of a state and have a list tape. The generated source is in run.source.
+    """
+    generator = _Generator(program)
+    source = generator.source()
+    namespace = dict(generator.constants)
+    namespace["IDS"] = dict(generator.ids)
+    namespace["NAMES"] = {number: state for state, number in generator.ids.items()}
+    exec(compile(source, "<HigherLevelTM compiled engine>", "exec"), namespace)
+    run = namespace["run"]
+    run.source = source
+    return run
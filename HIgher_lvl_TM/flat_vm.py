@@ -0,0 +1,382 @@
+"""
+Flat VM for HigherLevelTM programs
+
+lower() turns a compiled program (state -> instructions, see instruction_compiler, optionally after
+loop_fusion) into one linear instruction array:
+
+    - every state's instructions are laid out one after another, pc = entry[state] + currInstruction
+    - STATE X (also as the body of an IF) is an absolute jump to entry[X], STATE ACCEPT stops the VM
+    - operands are resolved to numeric slots: a tape cell address, the HEAD register or a constant
+    - after every state there's a stub that raises the IndexError the reference interpreter raises
+      when a state runs off its end, a STATE to a state the program doesn't have jumps to a stub that
+      raises its KeyError
+
+FlatVM executes the array as threaded code: every pc is a small generated function that does its
+instruction on the register locals (tape, head position, HEAD) and returns the next pc, so a step is
+`pc = code[pc]()` with no state lookup, no currInstruction bookkeeping and no operand kind checks.
+ACCEPT and fused loops (which stand for many steps) leave that loop through exceptions, so the loop
+itself doesn't test anything but the budget.
+
+Steps, budgets, tape promotion and results are exactly the reference interpreter's. With profile on
+the VM counts steps per pc, state_counts() and instruction_counts() add them up, report() prints
+where the time goes:
+
+    tm = HigherLevelTM(generate_pi_tm_macro(100), 0, False, BATCH=True, ENGINE="vm")
+    tm.vm.profile = True
+    tm.run()
+    print(tm.vm.report())
+"""
+from instruction_compiler import Op, LITERAL, MARKER, HEAD
+from codegen_engine import SYMBOLS, ARITHMETIC
+import kernels
+import tapes
+
+ACCEPT = "ACCEPT"
+
+
+class _Accept(Exception):
+    """STATE ACCEPT was executed"""
+
+
+class _Fused(Exception):
+    """A FUSED instruction, the VM runs its kernel with the remaining budget"""
+
+    def __init__(self, pc):
+        self.pc = pc
+
+
+class FlatProgram:
+    """
+    A lowered program.
+
+    Attributes:
+        entries: {state: pc of its first instruction}, also for the stubs of missing states.
+        states: State of every pc.
+        instructions: Decoded instruction of every pc (None for stubs).
+        missing: Stub pcs of the missing states.
+        targets: Jump target pc of every pc (STATE, IF ... STATE or the fallback of a FUSED), None if it falls through.
+        fused: {pc: kernel} of the FUSED instructions.
+        source: Generated source of the instruction functions.
+    """
+
+    def __init__(self, program):
+        self.entries = {}
+        self.states = []
+        self.instructions = []
+        for state, instructions in program.items():
+            self.entries[state] = len(self.states)
+            for instruction in instructions + [None]:  # None = fell off the end
+                self.states.append(state)
+                self.instructions.append(instruction)
+        # jumps to states the program doesn't have
+        self.missing = set()
+        for instructions in program.values():
+            for instruction in instructions:
+                target = _jump(instruction)
+                if target is not None and target != ACCEPT and target not in self.entries:
+                    self.entries[target] = len(self.states)
+                    self.missing.add(len(self.states))
+                    self.states.append(target)
+                    self.instructions.append(None)
+
+        self.targets = []
+        self.fused = {}
+        for pc, instruction in enumerate(self.instructions):
+            target = _jump(instruction)
+            self.targets.append(None if target in (None, ACCEPT) else self.entries[target])
+            if instruction is not None and instruction.op is Op.FUSED:
+                self.fused[pc] = instruction.target
+        self.source = _Generator(self).source()
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def listing(self) -> str:
+        """The flat program as text, one pc per line"""
+        lines = []
+        for pc, (state, instruction) in enumerate(zip(self.states, self.instructions)):
+            if self.entries.get(state) == pc:
+                lines.append(f"{state}:")
+            if instruction is not None:
+                text = instruction.text
+            else:
+                text = "<missing state>" if pc in self.missing else "<end of state>"
+            jump = f"  -> {self.targets[pc]}" if self.targets[pc] is not None else ""
+            lines.append(f"{pc:6d}  {text}{jump}")
+        return "\n".join(lines)
+
+
+def _jump(instruction):
+    # state an instruction can jump to, None if it can't
+    if instruction is None:
+        return None
+    if instruction.op is Op.STATE:
+        return instruction.target
+    if instruction.op in (Op.IF, Op.FUSED):
+        return _jump(instruction.body)
+    return None
+
+
+def lower(program) -> FlatProgram:
+    """
+    Flatten a compiled program, see the module docstring.
+
+    Args:
+        program: Compiled program (state -> instructions), possibly with FUSED states.
+
+    Returns:
+        FlatProgram: The lowered program.
+    """
+    return FlatProgram(program)
+
+
+class _Generator:
+    def __init__(self, flat):
+        self.flat = flat
+        self.lines = []
+
+    def emit(self, indent, line):
+        self.lines.append("    " * indent + line)
+
+    def value(self, operand):
+        kind, value = operand
+        if kind is LITERAL:
+            return repr(value)
+        elif kind is MARKER:
+            return f"t[{value}]"
+        elif kind is HEAD:
+            return "head"
+        return "None"
+
+    def grow(self, indent, position):
+        # checkArrSize
+        self.emit(indent, f"if {position} >= len(t): grow(t, {position})")
+
+    def instruction(self, indent, pc, instruction):
+        """Emit one instruction, returns True if it always leaves (jump or stop)"""
+        op = instruction.op
+        if op is Op.READ:
+            self.emit(indent, "head = t[h]")
+        elif op in ARITHMETIC:
+            cell = "t[h]" if instruction.target is None else f"t[{instruction.target}]"
+            self.emit(indent, f"{cell} {ARITHMETIC[op]} {self.value(instruction.value)}")
+        elif op is Op.MOD:
+            self.emit(indent, f"t[h] %= {self.value(instruction.value)}")
+        elif op is Op.SET:
+            if instruction.target is None:
+                self.emit(indent, f"t[h] = {self.value(instruction.value)}")
+            else:
+                self.emit(indent, f"value = {self.value(instruction.value)}")
+                self.grow(indent, instruction.target)
+                self.emit(indent, f"t[{instruction.target}] = value")
+        elif op is Op.MOVE:
+            self.emit(indent, f"h = {self.value(instruction.value)}")
+            self.grow(indent, "h")
+        elif op is Op.GOTO:
+            self.emit(indent, f"h = {instruction.target}")
+            self.grow(indent, "h")
+        elif op in (Op.MOVE_LEFT, Op.MOVE_RIGHT):
+            sign = "-" if op is Op.MOVE_LEFT else "+"
+            if instruction.value is None:
+                self.emit(indent, f"h {sign}= 1")
+                self.grow(indent, "h")
+            else:
+                self.emit(indent, f"h {sign}= {self.value(instruction.value)}")
+        elif op is Op.IF:
+            left = self.value(instruction.left)
+            right = self.value(instruction.value)
+            self.emit(indent, f"if {left} {SYMBOLS[instruction.compare]} {right}:")
+            self.instruction(indent + 1, pc, instruction.body)
+        elif op is Op.STATE:
+            if instruction.target == ACCEPT:
+                self.emit(indent, "raise Accept")
+            else:
+                self.emit(indent, f"return {self.flat.entries[instruction.target]}")
+            return True
+        elif op in (Op.ARRAY_FILL, Op.ARRAY_SCALE):
+            function = "fill" if op is Op.ARRAY_FILL else "scale"
+            self.emit(indent, f"value = {self.value(instruction.value)}")
+            self.grow(indent, instruction.end)
+            self.emit(indent, f"kernels.{function}(t, {instruction.target}, {instruction.end + 1}, value)")
+        elif op is Op.MOD_REDUCE_CARRY:
+            self.emit(indent, "store()")
+            self.emit(indent, f"kernels.run_mod_reduce_carry(tm, {', '.join(map(str, instruction.target))})")
+            self.emit(indent, "load()")
+        elif op is Op.FUSED:
+            self.emit(indent, f"raise Fused({pc})")
+            return True
+        elif op is Op.NOP:
+            self.emit(indent, "pass")
+        else:
+            raise ValueError(f"can't lower instruction '{instruction.text}'")
+        return False
+
+    def function(self, name, pc, instruction):
+        self.emit(1, f"def {name}():")
+        self.emit(2, "nonlocal t, h, head")
+        if instruction is None:
+            state = self.flat.states[pc]
+            if pc in self.flat.missing:
+                self.emit(2, f"raise KeyError({state!r})")
+            else:
+                self.emit(2, f"raise IndexError('state {state} has no instruction {pc - self.flat.entries[state]}')")
+        elif not self.instruction(2, pc, instruction):
+            self.emit(2, f"return {pc + 1}")
+
+    def source(self):
+        self.emit(0, "def build(tm):")
+        # registers, loaded from tm at the start of every run
+        self.emit(1, "t = None")
+        self.emit(1, "h = 0")
+        self.emit(1, "head = None")
+        self.emit(1, "def load():")
+        self.emit(2, "nonlocal t, h, head")
+        self.emit(2, "t = tm.tape")
+        self.emit(2, "h = tm.headPos")
+        self.emit(2, "head = tm.head")
+        self.emit(1, "def store():")
+        self.emit(2, "tm.tape = t")
+        self.emit(2, "tm.headPos = h")
+        self.emit(2, "tm.head = head")
+        for pc, instruction in enumerate(self.flat.instructions):
+            self.function(f"i{pc}", pc, instruction)
+        # the first instruction of a fused state, run when its kernel can't
+        for pc, instruction in enumerate(self.flat.instructions):
+            if instruction is not None and instruction.op is Op.FUSED:
+                self.function(f"b{pc}", pc, instruction.body)
+        self.emit(1, "code = [" + ", ".join(f"i{pc}" for pc in range(len(self.flat))) + "]")
+        self.emit(1, "bodies = {" + ", ".join(f"{pc}: b{pc}" for pc in self.flat.fused) + "}")
+        self.emit(1, "return code, bodies, load, store")
+        return "\n".join(self.lines) + "\n"
+
+
+class FlatVM:
+    """
+    Runs a FlatProgram on a HigherLevelTM machine's tape and registers.
+
+    Attributes:
+        flat: The FlatProgram.
+        profile: Count steps per pc while running (a bit slower).
+        counts: Steps per pc so far, fused kernels count all the steps they stand for at their pc.
+    """
+
+    def __init__(self, tm, program):
+        self.tm = tm
+        self.flat = lower(program)
+        namespace = {"grow": tapes.grow, "kernels": kernels, "Accept": _Accept, "Fused": _Fused}
+        exec(compile(self.flat.source, f"<{tm.name} flat VM>", "exec"), namespace)
+        self.code, self.bodies, self.load, self.store = namespace["build"](tm)
+        self.profile = False
+        self.counts = [0] * len(self.flat)
+
+    def run(self, limit) -> int:
+        """
+        Run up to limit steps from the machine's current state and instruction.
+
+        Returns:
+            int: Steps executed, tm.state/currInstruction/headPos/head/tape are updated.
+        """
+        tm = self.tm
+        flat = self.flat
+        code = self.code
+        counts = self.counts
+        pc = flat.entries[tm.state] + tm.currInstruction
+        steps = 0
+        # FUSED instruction whose kernel is still to run. Kernels run inside the try like every other
+        # instruction, so overflows in them promote the tape and retry them too
+        fused = None
+        self.load()
+        try:
+            while True:
+                try:
+                    if fused is not None:
+                        self.store()
+                        done = flat.fused[fused].run(tm, limit - steps)
+                        self.load()
+                        if done:
+                            if self.profile:
+                                counts[pc] += done - 1
+                            steps += done
+                            fused = None
+                            if tm.state == ACCEPT:
+                                tm.currInstruction = 0
+                                return steps
+                            pc = flat.entries[tm.state]
+                        else:
+                            pc = self.bodies[fused]()
+                            steps += 1
+                            fused = None
+                    if self.profile:
+                        while steps < limit:
+                            counts[pc] += 1
+                            pc = code[pc]()
+                            steps += 1
+                    else:
+                        while steps < limit:
+                            pc = code[pc]()
+                            steps += 1
+                    break
+                except _Accept:
+                    steps += 1
+                    tm.state = ACCEPT
+                    tm.currInstruction = 0
+                    self.store()
+                    return steps
+                except _Fused as instruction:
+                    fused = instruction.pc
+                except (OverflowError, TypeError):
+                    # same as the reference interpreter: the write failed before anything changed
+                    if not tapes.can_promote(tm.tape):
+                        raise
+                    if self.profile and fused is None:
+                        counts[pc] -= 1
+                    self.store()
+                    tm.tape = tapes.promote(tm.tape)
+                    self.load()
+        except BaseException:
+            self.store()
+            self._sync(pc)
+            raise
+        self.store()
+        self._sync(pc)
+        return steps
+
+    def _sync(self, pc):
+        state = self.flat.states[pc]
+        self.tm.state = state
+        self.tm.currInstruction = pc - self.flat.entries[state]
+
+    def reset_counts(self):
+        self.counts = [0] * len(self.flat)
+
+    def state_counts(self) -> dict:
+        """{state: steps executed in it}, most first"""
+        totals = {}
+        for state, count in zip(self.flat.states, self.counts):
+            if count:
+                totals[state] = totals.get(state, 0) + count
+        return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+    def instruction_counts(self) -> list:
+        """[(steps, pc, state, index in the state, instruction text)] of every pc that ran, most first"""
+        rows = []
+        for pc, count in enumerate(self.counts):
+            if count:
+                state = self.flat.states[pc]
+                instruction = self.flat.instructions[pc]
+                text = instruction.text if instruction is not None else "<stub>"
+                rows.append((count, pc, state, pc - self.flat.entries[state], text))
+        rows.sort(key=lambda row: -row[0])
+        return rows
+
+    def report(self, top=15) -> str:
+        """Steps per state and the top instructions as a table"""
+        total = sum(self.counts) or 1
+        lines = [f"{'steps':>12} {'share':>6}  state"]
+        for state, count in self.state_counts().items():
+            lines.append(f"{count:12,d} {100 * count / total:5.1f}%  {state}")
+        lines.append("")
+        lines.append(f"{'steps':>12} {'share':>6}  {'pc':>5}  instruction")
+        for count, pc, state, index, text in self.instruction_counts()[:top]:
+            lines.append(f"{count:12,d} {100 * count / total:5.1f}%  {pc:5d}  {state}[{index}] {text}")
+        return "\n".join(lines)
@@ -0,0 +1,170 @@
+"""
+Load-time compiler for HigherLevelTM instructions
+"""
+import operator
+from collections import namedtuple
+from enum import IntEnum
+from typing import Dict, List, Any
+
+
+class Op(IntEnum):
+    READ = 0
+    ADD = 1
+    SUB = 2
+    MUL = 3
+    DIV = 4
+    MOD = 5
+    SET = 6
+    MOVE = 7
+    GOTO = 8
+    MOVE_LEFT = 9
+    MOVE_RIGHT = 10
+    IF = 11
+    STATE = 12
+    NOP = 13  # unknown instruction types do nothing (same as the old string interpreter)
+    ARRAY_FILL = 14
+    ARRAY_SCALE = 15
+    FUSED = 16  # inserted by loop_fusion, never written by hand
+    MOD_REDUCE_CARRY = 17
+
+
+class Kind(IntEnum):
+    LITERAL = 0  # plain integer
+    MARKER = 1   # value stored on the tape at a marker address
+    HEAD = 2     # value last read with READ
+    NONE = 3     # anything else, readValue used to return None for these (e.g. "-1")
+
+
+# Module level aliases, enum attribute lookups are slow in the interpreter's hot loop
+LITERAL, MARKER, HEAD, NONE = Kind.LITERAL, Kind.MARKER, Kind.HEAD, Kind.NONE
+
+
+# op: Op, target: tape address for the "<var> <value>" forms (None = head cell) or the new state name,
+# value: (Kind, value) operand, body: nested Instruction for IF, text: original string for printing,
+# end: last tape address of the range for the ARRAY_* instructions
+Instruction = namedtuple("Instruction", ["op", "target", "value", "body", "compare", "left", "text", "end"], defaults=[None])
+
+COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<=": operator.le,
+    ">=": operator.ge,
+    "<": operator.lt,
+    ">": operator.gt,
+}
+
+
+def compile_operand(token: str, tape_markers: Dict[str, int]):
+    """
+    Resolve an operand once so the interpreter doesn't have to re-check isnumeric()/markers every step.
+
+    Args:
+        token: Operand as written in the instruction (integer, marker name or HEAD).
+        tape_markers: Marker name -> tape address.
+
+    Returns:
+        tuple: (Kind, value) pair.
+    """
+    if token.isnumeric():
+        return (LITERAL, int(token))
+    elif token in tape_markers:
+        return (MARKER, tape_markers[token])
+    elif token == "HEAD":
+        return (HEAD, None)
+    return (NONE, None)
+
+
+def _marker(token: str, tape_markers: Dict[str, int], instruction: str) -> int:
+    if token not in tape_markers:
+        raise ValueError(f"unknown tape marker '{token}' in instruction '{instruction}'")
+    return tape_markers[token]
+
+
+def _address(token: str, tape_markers: Dict[str, int], instruction: str) -> int:
+    # marker or plain tape address
+    if token.isnumeric():
+        return int(token)
+    return _marker(token, tape_markers, instruction)
+
+
+def compile_instruction(instruction: str, tape_markers: Dict[str, int]) -> Instruction:
+    """
+    Decode a single instruction string (see HigherLevelTM for the instruction set).
+
+    Args:
+        instruction: Instruction string, e.g. "IF i >= LEN STATE STAGE_2_MAIN_LOOP".
+        tape_markers: Marker name -> tape address.
+
+    Returns:
+        Instruction: Decoded instruction.
+    """
+    parts = instruction.split()
+    name, parameters = parts[0], parts[1:]
+
+    if name not in Op.__members__ or name in ("NOP", "FUSED"):
+        return Instruction(Op.NOP, None, None, None, None, None, instruction)
+    op = Op[name]
+
+    target = None
+    value = None
+    body = None
+    compare = None
+    left = None
+
+    match op:
+        case Op.ADD | Op.SUB | Op.MUL | Op.DIV | Op.SET:
+            if len(parameters) == 1:
+                value = compile_operand(parameters[0], tape_markers)
+            else:
+                target = _marker(parameters[0], tape_markers, instruction)
+                value = compile_operand(parameters[1], tape_markers)
+
+        case Op.MOD | Op.MOVE:
+            value = compile_operand(parameters[0], tape_markers)
+
+        case Op.GOTO:
+            target = _marker(parameters[0], tape_markers, instruction)
+
+        case Op.MOVE_LEFT | Op.MOVE_RIGHT:
+            if len(parameters) > 0:
+                value = compile_operand(parameters[0], tape_markers)
+
+        case Op.IF:
+            if parameters[1] not in COMPARISONS:
+                raise ValueError(f"unknown comparison '{parameters[1]}' in instruction '{instruction}'")
+            left = compile_operand(parameters[0], tape_markers)
+            compare = COMPARISONS[parameters[1]]
+            value = compile_operand(parameters[2], tape_markers)
+            body = compile_instruction(" ".join(parameters[3:]), tape_markers)
+
+        case Op.STATE:
+            target = parameters[0]
+
+        case Op.ARRAY_FILL | Op.ARRAY_SCALE:
+            start = _address(parameters[0], tape_markers, instruction)
+            end = _address(parameters[1], tape_markers, instruction)
+            value = compile_operand(parameters[2], tape_markers)
+            return Instruction(op, start, value, body, compare, left, instruction, end)
+
+        case Op.MOD_REDUCE_CARRY:
+            # (index, carry, divisor) variable addresses
+            target = tuple(_marker(parameter, tape_markers, instruction) for parameter in parameters[:3])
+
+    return Instruction(op, target, value, body, compare, left, instruction)
+
+
+def compile_instructions(turing_machine: Dict[str, Any]) -> Dict[str, List[Instruction]]:
+    """
+    Compile every state of a TM macro into a table of decoded instructions.
+
+    Args:
+        turing_machine: TM macro description (see instructions_generator.generate_pi_tm_macro).
+
+    Returns:
+        Dict[str, List[Instruction]]: State name -> decoded instructions.
+    """
+    tape_markers = turing_machine["tape_markers"]
+    return {
+        state: [compile_instruction(instruction, tape_markers) for instruction in instructions]
+        for state, instructions in turing_machine["instructions"].items()
+    }
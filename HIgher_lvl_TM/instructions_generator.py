@@ -7,20 +7,30 @@ import math
 import pprint
 from typing import Dict, Any
 
-def generate_pi_tm_macro(n_digits: int = 33) -> Dict[str, Any]:
+def generate_pi_tm_macro(n_digits: int = 33, optimized: bool = False, capacity: int = None) -> Dict[str, Any]:
     """
     Generate a TM macro description for computing pi to n_digits.
 
     Args:
         n_digits: Number of digits (not decimal places) to compute. Defaults to 33.
+        optimized: Use superinstructions (ARRAY_FILL/ARRAY_SCALE/MOD_REDUCE_CARRY) instead of the
+            per-cell loops in stages 1, 3 and 4. Same tape, far fewer steps. Defaults to False.
+        capacity: Size the array and the OUTPUT section for this many digits but stop after n_digits.
+            A finished run can then be continued up to capacity digits with HigherLevelTM.extendRun
+            and a macro generated with the same capacity. Defaults to n_digits.
 
     Returns:
         Dict[str, Any]: Dictionary containing the TM macro description.
     """
 
+    if capacity is None:
+        capacity = n_digits
+    if capacity < n_digits:
+        raise ValueError(f"capacity ({capacity}) has to be at least n_digits ({n_digits})")
+
     # calc array length based on formula in spigot algo paper
     # len = (10n/3)
-    array_length = math.ceil(10 * n_digits / 3)
+    array_length = math.ceil(10 * capacity / 3)
 
     # calc tape marker positions based on array length
     # START | LEN | ARRAY (includes a0 at position 0) | PREDIGIT | NINES | OUTPUT | WORK
@@ -31,19 +41,21 @@ def generate_pi_tm_macro(n_digits: int = 33) -> Dict[str, Any]:
     predigit_pos = array_pos + array_length
     nines_pos = predigit_pos + 1
     output_pos = nines_pos + 1
-    work_pos = output_pos + n_digits
+    work_pos = output_pos + capacity
 
     i = work_pos
     
 
     tm_macro = {
-        "name": f"M_PI_{n_digits}_DIGITS",
+        "name": f"M_PI_{n_digits}_DIGITS" + (f"_CAPACITY_{capacity}" if capacity != n_digits else ""),
         
         "description": f"Compute pi to {n_digits} digits using spigot algorithm",
         
         "params": {
             "n_digits": n_digits,
             "array_length": array_length,
+            "capacity": capacity,
+            "optimized": optimized,
         },
 
         "tape_markers": {
@@ -175,6 +187,7 @@ def generate_pi_tm_macro(n_digits: int = 33) -> Dict[str, Any]:
             # STAGE_8_ADD: Increment previous digit by 1
             # STAGE_8_PREDIGIT_10_B: Output 0s for each buffered 9
             "STAGE_8_PREDIGIT_10": [
+                "SET q 0",  # the held digit after a carry is 0, not 10 (STAGE_10 stores q)
                 "GOTO PREDIGIT",
                 "READ",
                 "SET d HEAD",
@@ -195,6 +208,7 @@ def generate_pi_tm_macro(n_digits: int = 33) -> Dict[str, Any]:
                 "GOTO NINES",
                 "READ",
                 "IF HEAD == 0 STATE STAGE_10_MAIN_LOOP_END",
+                f"IF COUNTER >= {capacity} STATE STAGE_10_MAIN_LOOP_END",  # OUTPUT is full, don't run into WORK
                 "GOTO OUTPUT",
                 "MOVE_RIGHT COUNTER",
                 "SET 0",
@@ -224,6 +238,7 @@ def generate_pi_tm_macro(n_digits: int = 33) -> Dict[str, Any]:
                 "GOTO NINES",
                 "READ",
                 "IF HEAD == 0 STATE STAGE_10_MAIN_LOOP_END",
+                f"IF COUNTER >= {capacity} STATE STAGE_10_MAIN_LOOP_END",  # OUTPUT is full, don't run into WORK
                 "GOTO OUTPUT",
                 "MOVE_RIGHT COUNTER",
                 "SET 9",
@@ -248,6 +263,7 @@ def generate_pi_tm_macro(n_digits: int = 33) -> Dict[str, Any]:
                 "READ",
                 "IF HEAD == -1 STATE ACCEPT",
                 "IF HEAD > 8 STATE ACCEPT",
+                f"IF COUNTER >= {capacity} STATE ACCEPT",
                 "GOTO OUTPUT",
                 "MOVE_RIGHT COUNTER",
                 "SET HEAD",
@@ -256,6 +272,25 @@ def generate_pi_tm_macro(n_digits: int = 33) -> Dict[str, Any]:
         }
     }
 
+    if optimized:
+        # Same end state as the loops: every cell done, i = LEN and the head on the last cell
+        tm_macro["instructions"]["STAGE_1_ARRAY_INIT"] = [
+            "ARRAY_FILL ARRAY ARRAY_END 2",
+            "SET i LEN",
+            "GOTO ARRAY_END",
+            "STATE STAGE_2_MAIN_LOOP"
+        ]
+        tm_macro["instructions"]["STAGE_3_MULTIPLY"] = [
+            "ARRAY_SCALE ARRAY ARRAY_END 10",
+            "SET i LEN",
+            "GOTO ARRAY_END",
+            "STATE STAGE_4_MOD_REDUCE"
+        ]
+        tm_macro["instructions"]["STAGE_4_MOD_LOOP"] = [
+            "MOD_REDUCE_CARRY i q d",
+            "STATE STAGE_5_HANDLE_A0"
+        ]
+
     return tm_macro
 
 
@@ -0,0 +1,161 @@
+"""
+Native implementations of whole-array instructions for HigherLevelTM
+
+Every kernel works on every tape backend (see tapes.py). On an int64 tape a result that doesn't fit
+raises OverflowError before anything is written, so the interpreter can promote the tape and retry.
+NumPy is used for the elementwise kernels when it's installed, plain slices otherwise.
+"""
+from array import array
+
+import tapes
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INT64_MAX = 2**63 - 1
+
+
+def fill(tape, start, stop, value):
+    """
+    tape[start:stop] = value
+
+    Args:
+        tape: Tape (list, array or PagedTape).
+        start: First address.
+        stop: One past the last address.
+        value: Value to write.
+    """
+    count = stop - start
+    if count <= 0:
+        return
+    if not tapes.is_compact(tape):
+        tape[start:stop] = [value] * count
+    else:
+        tape[start:stop] = array(tape.typecode, [value]) * count
+
+
+def scale(tape, start, stop, factor):
+    """
+    tape[start:stop] *= factor, elementwise
+
+    Args:
+        tape: Tape (list, array or PagedTape).
+        start: First address.
+        stop: One past the last address.
+        factor: Multiplier.
+    """
+    if stop - start <= 0:
+        return
+    if not tapes.is_compact(tape):
+        tape[start:stop] = [cell * factor for cell in tape[start:stop]]
+    elif np is not None and tape.typecode == "q":
+        view = np.frombuffer(tape, dtype=np.int64)[start:stop]
+        try:
+            # int64 math wraps around silently, so check for overflow up front
+            if factor != 0 and int(np.abs(view).max()) > INT64_MAX // abs(factor):
+                raise OverflowError("scaled cell doesn't fit in 64 bits")
+            view *= factor
+        finally:
+            del view  # release the buffer, the array can't be resized while it's exported
+    else:
+        tape[start:stop] = array(tape.typecode, [cell * factor for cell in tape[start:stop]])
+
+
+def mod_reduce_carry(cells, i):
+    """
+    The spigot's right-to-left mod reduction with carry, STAGE_4_MOD_LOOP in one tight loop.
+    Starting at the last cell and going left, for every cell: d = 2i+1, carry = (cell // d) * i,
+    cell %= d, the carry is added to the cell on the left and i goes down by one, until i <= 0
+    (the first pass always runs, like the state does).
+
+    Args:
+        cells: List of cells, cells[-1] is the cell under the head. Needs max(i, 1) + 1 cells, modified in place.
+        i: Index variable on entry.
+
+    Returns:
+        tuple: (passes, i, q, d, head) with the variables as the state leaves them.
+    """
+    position = len(cells) - 1
+    while True:
+        head = cells[position]
+        d = 2 * i + 1
+        cells[position] = head % d
+        q = (head // d) * i
+        i -= 1
+        position -= 1
+        cells[position] += q
+        if i <= 0:
+            return len(cells) - 1 - position, i, q, d, head
+
+
+def mod_reduce_carry_passes(i):
+    """How many cells mod_reduce_carry will visit for this index value"""
+    return i if i >= 1 else 1
+
+
+def run_mod_reduce_carry(tm, i_address, q_address, d_address) -> int:
+    """
+    Run mod_reduce_carry on a machine, with the index/carry/divisor variables at the given addresses.
+    Leaves the tape, head position, HEAD and the variables exactly like the interpreted state would.
+
+    Args:
+        tm: HigherLevelTM machine.
+        i_address: Tape address of the index variable.
+        q_address: Tape address of the carry variable.
+        d_address: Tape address of the divisor variable.
+
+    Returns:
+        int: Number of cells visited.
+    """
+    tape = tm.tape
+    position = tm.headPos
+    i = tape[i_address]
+    passes = mod_reduce_carry_passes(i) if type(i) is int else 0
+    low = position - passes
+
+    tm.checkArrSize(q_address)  # SET q / SET d grow the tape like this
+    tm.checkArrSize(d_address)
+    if passes == 0 or low < 0 or position >= len(tape) or \
+            any(low <= address <= position for address in (i_address, q_address, d_address)):
+        # Wraps around the tape, a variable sits inside the swept cells or something isn't an int:
+        # do it one operation at a time, exactly like the instructions would
+        return _mod_reduce_carry_exact(tm, i_address, q_address, d_address)
+
+    cells = tape[low:position + 1].tolist() if tapes.is_compact(tape) else tape[low:position + 1]
+    passes, i, q, d, head = mod_reduce_carry(cells, i)
+    if tapes.is_compact(tape):
+        # raises OverflowError before anything is written if some value doesn't fit
+        cells = array(tape.typecode, cells)
+        array(tape.typecode, [i, q, d])
+    tape[low:position + 1] = cells
+    tape[i_address] = i
+    tape[q_address] = q
+    tape[d_address] = d
+    tm.head = head
+    tm.headPos = low
+    return passes
+
+
+def _mod_reduce_carry_exact(tm, i_address, q_address, d_address) -> int:
+    if tapes.is_compact(tm.tape):
+        tm.tape = tapes.promote(tm.tape)  # partial writes can't be retried, so no int64 tape here
+    tape = tm.tape
+    passes = 0
+    while True:
+        tm.head = tape[tm.headPos]
+        tape[q_address] = tm.head
+        tape[d_address] = tape[i_address]
+        tape[d_address] *= 2
+        tape[d_address] += 1
+        tape[tm.headPos] %= tape[d_address]
+        tape[q_address] //= tape[d_address]
+        tape[q_address] *= tape[i_address]
+        tape[i_address] -= 1
+        tm.headPos -= 1
+        tm.checkArrSize(tm.headPos)
+        tape[tm.headPos] += tape[q_address]
+        passes += 1
+        if tape[i_address] <= 0:
+            return passes
@@ -0,0 +1,329 @@
+"""
+Load-time loop fusion for HigherLevelTM programs
+
+Finds self-looping states that sweep the head over a block of cells and replaces them with a kernel
+that does the whole sweep at once. Works on any compiled program (see instruction_compiler), so
+existing TM_instructions.json files get faster without being regenerated.
+
+Map loops (the shape of STAGE_1_ARRAY_INIT and STAGE_3_MULTIPLY):
+
+    S: <body>                     k >= 1 head cell ops: SET/ADD/SUB/MUL/DIV/MOD <value>
+       ADD|SUB <idx> <c>          literal step, c != 0
+       IF <idx> <cmp> <bound> STATE <exit>
+       MOVE_RIGHT | MOVE_LEFT     by one cell
+       STATE S
+
+Why the fused kernel is equivalent (checked at load time, then at run time on every entry):
+    - body operands don't change during the loop: they're literals, HEAD (there's no READ in the
+      body) or marker cells that are neither idx nor inside the swept range
+    - so every cell gets the same function applied exactly once, in order, independent of the others
+    - idx only changes through the step and bound is read from a cell outside the sweep, so the
+      exit condition after iteration K is cmp(idx0 + K*c, bound) and K has a closed form
+    - the interpreter would then have executed K*(k+4) - 2 instructions and left: idx = idx0 + K*c,
+      the head on the last cell visited, the tape grown up to that cell (MOVE_RIGHT's checkArrSize)
+      and state = exit, which is exactly what the kernel writes back
+Anything the closed form can't promise (an infinite loop, a marker inside the sweep, sweeping past
+cell 0, a zero divisor, a non-int value, not enough budget left) falls back to the normal
+instructions for that pass, so errors and budgets behave exactly like before.
+
+Carry loops (the shape of STAGE_4_MOD_LOOP, variables i, q, d all different):
+
+    S: READ, SET q HEAD, SET d i, MUL d 2, ADD d 1, MOD d, DIV q d, MUL q i, SUB i 1,
+       MOVE_LEFT, ADD q, IF i <= 0 STATE <exit>, STATE S
+
+This one is sequential (each carry feeds the next cell) so it isn't a map, it runs as
+kernels.run_mod_reduce_carry, which replays exactly these operations in a local loop. It visits
+max(i, 1) cells, so the interpreter would have executed 13 * max(i, 1) - 1 instructions.
+"""
+import operator
+from array import array
+
+from instruction_compiler import Op, Instruction, LITERAL, MARKER, HEAD
+import kernels
+import tapes
+
+ELEMENTWISE = {
+    Op.SET: lambda cell, value: value,
+    Op.ADD: operator.add,
+    Op.SUB: operator.sub,
+    Op.MUL: operator.mul,
+    Op.DIV: operator.floordiv,
+    Op.MOD: operator.mod,
+}
+
+
+def _first_true(start, step, compare, bound):
+    """
+    Smallest K >= 1 with compare(start + K*step, bound), or None if there isn't one.
+
+    Args:
+        start: idx value when the loop is entered.
+        step: Added to idx every iteration (never 0).
+        compare: One of the instruction_compiler.COMPARISONS functions.
+        bound: Right hand side of the comparison.
+
+    Returns:
+        int or None: Number of iterations.
+    """
+    if compare(start + step, bound):
+        return 1
+
+    if compare is operator.ne:
+        return 2  # start + step == bound, the next value can't be
+    if compare is operator.eq:
+        distance = bound - start
+        if distance % step == 0 and distance // step >= 1:
+            return distance // step
+        return None
+
+    # Monotone comparisons: normalize to "start + K*step >= bound"
+    if compare is operator.gt:
+        bound += 1
+    elif compare is operator.le:
+        start, step, bound = -start, -step, -bound
+    elif compare is operator.lt:
+        start, step, bound = -start, -step, -(bound - 1)
+    if step < 0:
+        return None  # moving away from the bound, the interpreter would loop forever
+    return -((start - bound) // step)  # ceil((bound - start) / step)
+
+
+class MapLoop:
+    """Fused kernel for one recognized state, see the module docstring"""
+
+    def __init__(self, state, body, idx, step, compare, bound, exit_state, direction):
+        self.state = state
+        self.body = body  # [(Op, operand)]
+        self.idx = idx
+        self.step = step
+        self.compare = compare
+        self.bound = bound
+        self.exit_state = exit_state
+        self.direction = direction
+        # steps per full pass through the state
+        self.length = len(body) + 4
+
+    def run(self, tm, budget) -> int:
+        """
+        Run the whole loop on tm.
+
+        Args:
+            tm: HigherLevelTM machine sitting on the first instruction of this state.
+            budget: Max number of instructions the loop may account for.
+
+        Returns:
+            int: Instructions executed (0 = couldn't prove it's safe, nothing was touched).
+        """
+        tape = tm.tape
+        start = tape[self.idx]
+        bound = tm.readValue(self.bound)
+        values = [tm.readValue(operand) for _, operand in self.body]
+        if type(start) is not int or type(bound) is not int or any(type(value) is not int for value in values):
+            return 0
+        if any(op in (Op.DIV, Op.MOD) and value == 0 for (op, _), value in zip(self.body, values)):
+            return 0
+
+        iterations = _first_true(start, self.step, self.compare, bound)
+        if iterations is None:
+            return 0
+        steps = iterations * self.length - 2
+        if steps > budget:
+            return 0
+
+        first = tm.headPos
+        last = first + (iterations - 1) * self.direction
+        low, high = min(first, last), max(first, last)
+        if low < 0 or first >= len(tape):
+            return 0
+        for address in [self.idx, self.bound[1] if self.bound[0] is MARKER else None] + \
+                       [operand[1] for _, operand in self.body if operand[0] is MARKER]:
+            if address is not None and low <= address <= high:
+                return 0
+
+        # Anything that can overflow an int64 tape raises before the first write, so the
+        # interpreter can promote the tape and run this again
+        end = start + iterations * self.step
+        if tapes.is_compact(tape):
+            array(tape.typecode, [end])
+        if self.direction > 0:
+            tm.checkArrSize(high)  # same growth as MOVE_RIGHT would have done
+        if len(self.body) == 1 and self.body[0][0] is Op.SET:
+            kernels.fill(tape, low, high + 1, values[0])
+        elif len(self.body) == 1 and self.body[0][0] is Op.MUL:
+            kernels.scale(tape, low, high + 1, values[0])
+        else:
+            cells = tape[low:high + 1]
+            for (op, _), value in zip(self.body, values):
+                apply = ELEMENTWISE[op]
+                cells = [apply(cell, value) for cell in cells]
+            if tapes.is_compact(tape):
+                cells = array(tape.typecode, cells)
+            tape[low:high + 1] = cells
+        tape[self.idx] = end
+
+        tm.headPos = last
+        tm.state = self.exit_state
+        tm.currInstruction = -1  # Will be incremented to 0 by the main loop
+        if tm.tracer is not None:
+            tm.tracer.state(tm)
+        return steps
+
+
+class CarryLoop:
+    """Fused kernel for a STAGE_4_MOD_LOOP shaped state, see the module docstring"""
+
+    def __init__(self, state, i, q, d, exit_state):
+        self.state = state
+        self.i = i
+        self.q = q
+        self.d = d
+        self.exit_state = exit_state
+
+    def run(self, tm, budget) -> int:
+        """Same as MapLoop.run"""
+        i = tm.tape[self.i]
+        if type(i) is not int:
+            return 0
+        steps = 13 * kernels.mod_reduce_carry_passes(i) - 1
+        if steps > budget:
+            return 0
+
+        kernels.run_mod_reduce_carry(tm, self.i, self.q, self.d)
+
+        tm.state = self.exit_state
+        tm.currInstruction = -1  # Will be incremented to 0 by the main loop
+        if tm.tracer is not None:
+            tm.tracer.state(tm)
+        return steps
+
+
+def recognize_carry(state, instructions):
+    """
+    Check whether a state is a fusable carry loop.
+
+    Args:
+        state: State name.
+        instructions: Compiled instructions of that state.
+
+    Returns:
+        CarryLoop or None: The kernel, or None if the state doesn't have the shape.
+    """
+    if len(instructions) != 13:
+        return None
+    read, set_q, set_d, double_d, inc_d, mod, div_q, mul_q, dec_i, move, add_q, test, loop = instructions
+    q, d = set_q.target, set_d.target
+    if set_d.value is None or set_d.value[0] is not MARKER:
+        return None
+    i = set_d.value[1]
+    if None in (q, d) or len({i, q, d}) != 3:
+        return None
+
+    expected = [
+        (read, Op.READ, None, None),
+        (set_q, Op.SET, q, (HEAD, None)),
+        (set_d, Op.SET, d, (MARKER, i)),
+        (double_d, Op.MUL, d, (LITERAL, 2)),
+        (inc_d, Op.ADD, d, (LITERAL, 1)),
+        (mod, Op.MOD, None, (MARKER, d)),
+        (div_q, Op.DIV, q, (MARKER, d)),
+        (mul_q, Op.MUL, q, (MARKER, i)),
+        (dec_i, Op.SUB, i, (LITERAL, 1)),
+        (move, Op.MOVE_LEFT, None, None),
+        (add_q, Op.ADD, None, (MARKER, q)),
+    ]
+    for instruction, op, target, value in expected:
+        if instruction.op is not op or instruction.target != target or instruction.value != value:
+            return None
+
+    if test.op is not Op.IF or test.left != (MARKER, i) or test.compare is not operator.le or test.value != (LITERAL, 0):
+        return None
+    if test.body.op is not Op.STATE or test.body.target == state:
+        return None
+    if loop.op is not Op.STATE or loop.target != state:
+        return None
+
+    return CarryLoop(state, i, q, d, test.body.target)
+
+
+def recognize(state, instructions):
+    """
+    Check whether a state is a fusable loop of either kind.
+
+    Args:
+        state: State name.
+        instructions: Compiled instructions of that state.
+
+    Returns:
+        MapLoop, CarryLoop or None: The kernel, or None if nothing matched.
+    """
+    return recognize_map(state, instructions) or recognize_carry(state, instructions)
+
+
+def recognize_map(state, instructions):
+    """
+    Check whether a state is a fusable map loop.
+
+    Args:
+        state: State name.
+        instructions: Compiled instructions of that state.
+
+    Returns:
+        MapLoop or None: The kernel, or None if the state doesn't have the shape.
+    """
+    if len(instructions) < 5:
+        return None
+    *body, advance, test, move, loop = instructions
+
+    if loop.op is not Op.STATE or loop.target != state:
+        return None
+    if move.op not in (Op.MOVE_RIGHT, Op.MOVE_LEFT) or move.value is not None:
+        return None
+    direction = 1 if move.op is Op.MOVE_RIGHT else -1
+
+    if advance.op not in (Op.ADD, Op.SUB) or advance.target is None or advance.value[0] is not LITERAL:
+        return None
+    idx = advance.target
+    step = advance.value[1] if advance.op is Op.ADD else -advance.value[1]
+    if step == 0:
+        return None
+
+    if test.op is not Op.IF or test.left != (MARKER, idx) or test.value[0] not in (LITERAL, MARKER):
+        return None
+    if test.value == (MARKER, idx) or test.body.op is not Op.STATE or test.body.target == state:
+        return None
+
+    kernel_body = []
+    for instruction in body:
+        if instruction.op not in ELEMENTWISE or instruction.target is not None:
+            return None
+        if instruction.value[0] not in (LITERAL, MARKER, HEAD) or instruction.value == (MARKER, idx):
+            return None
+        kernel_body.append((instruction.op, instruction.value))
+
+    return MapLoop(state, kernel_body, idx, step, test.compare, test.value, test.body.target, direction)
+
+
+def fuse_loops(program):
+    """
+    Replace the first instruction of every recognized state with a FUSED instruction.
+    The original instructions stay in place, FUSED falls back to them when the kernel can't run.
+
+    Args:
+        program: Compiled program (state -> instructions), not modified.
+
+    Returns:
+        tuple: (new program, {state: kernel} for the fused states).
+    """
+    fused = {}
+    new_program = {}
+    for state, instructions in program.items():
+        kernel = recognize(state, instructions)
+        if kernel is None:
+            new_program[state] = instructions
+            continue
+        fused[state] = kernel
+        first = instructions[0]
+        new_program[state] = [
+            Instruction(Op.FUSED, kernel, None, first, None, None, f"FUSED {state} ({first.text})")
+        ] + instructions[1:]
+    return new_program, fused
@@ -0,0 +1,170 @@
+"""
+Tape storage backends for HigherLevelTM
+
+The interpreter only needs indexing, slicing, len() and extend(), so a backend is just a sequence:
+    "list"   plain Python list, any value fits (the original behaviour)
+    "int64"  array('q'), 8 bytes per cell instead of a pointer + boxed int. Writing a value that
+             doesn't fit raises OverflowError (or TypeError for None), the interpreter then calls
+             promote() and retries the instruction on a list, so results never change.
+
+    "paged"  PagedTape, fixed size pages that are only allocated when a cell on them is written.
+             Memory follows the cells actually touched instead of the highest address, and negative
+             positions are real cells (on a list MOVE_LEFT past 0 silently indexes from the end).
+             Pages are lists, so any value fits and there's nothing to promote.
+
+Markers aren't stored on the tape, they live in tape_markers (HigherLevelTM.variables).
+NumPy isn't used here on purpose: single element access from Python is slower than array/list and
+in-place int64 math wraps around silently instead of raising.
+"""
+from array import array
+
+LIST = "list"
+INT64 = "int64"
+PAGED = "paged"
+KINDS = (LIST, INT64, PAGED)
+
+# 4096 cells per page
+PAGE_BITS = 12
+
+
+class PagedTape:
+    """
+    Sparse tape made of 2**page_bits cell pages that are allocated on the first write.
+    Behaves like the list the interpreter expects: reads of cells nobody wrote are 0, len() is one past
+    the highest cell written or grown to, slices (step 1) give lists. Unlike a list, negative
+    positions (and negative slice bounds) are actual cells left of 0, not counted from the end.
+    """
+
+    def __init__(self, cells=(), page_bits=PAGE_BITS):
+        self.page_bits = page_bits
+        self.page_size = 1 << page_bits
+        self.mask = self.page_size - 1
+        self.pages = {}  # page number -> list of cells
+        self.length = 0
+        self.lowest = 0  # leftmost cell written, <= 0
+        self.extend(cells)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, position):
+        if type(position) is slice:
+            return [self[cell] for cell in self._range(position)]
+        page = self.pages.get(position >> self.page_bits)
+        if page is None:
+            return 0
+        return page[position & self.mask]
+
+    def __setitem__(self, position, value):
+        if type(position) is slice:
+            positions = self._range(position)
+            values = list(value)
+            if len(values) != len(positions):
+                raise ValueError(f"can't assign {len(values)} values to a slice of {len(positions)} cells")
+            for cell, item in zip(positions, values):
+                self[cell] = item
+            return
+        number = position >> self.page_bits
+        page = self.pages.get(number)
+        if page is None:
+            page = self.pages[number] = [0] * self.page_size
+        page[position & self.mask] = value
+        if position >= self.length:
+            self.length = position + 1
+        elif position < self.lowest:
+            self.lowest = position
+
+    def __iter__(self):
+        for position in range(self.length):
+            yield self[position]
+
+    def __repr__(self):
+        return f"PagedTape(length={self.length}, lowest={self.lowest}, pages={len(self.pages)})"
+
+    def _range(self, index):
+        if index.step not in (None, 1):
+            raise ValueError("PagedTape slices only support step 1")
+        start = 0 if index.start is None else index.start
+        stop = self.length if index.stop is None else index.stop
+        return range(start, max(start, stop))
+
+    def extend(self, values):
+        for value in values:
+            self[self.length] = value
+
+    def grow(self, position):
+        """Make position part of the tape (what extending a list with zeros does) without allocating"""
+        if position >= self.length:
+            self.length = position + 1
+
+    def tolist(self) -> list:
+        """Cells 0 .. len-1, negative cells aren't included"""
+        return list(self)
+
+    def allocated_cells(self) -> int:
+        return len(self.pages) * self.page_size
+
+
+def new_tape(kind: str, cells=()):
+    """
+    Create a tape of the given kind.
+
+    Args:
+        kind: One of KINDS.
+        cells: Initial cell values.
+
+    Returns:
+        list or array: The tape.
+    """
+    if kind == LIST:
+        return list(cells)
+    elif kind == INT64:
+        try:
+            return array("q", cells)
+        except (OverflowError, TypeError):
+            # some cell doesn't fit, start out promoted
+            return list(cells)
+    elif kind == PAGED:
+        return PagedTape(cells)
+    raise ValueError(f"unknown tape kind '{kind}', expected one of {KINDS}")
+
+
+def is_compact(tape) -> bool:
+    """True for int64 storage (array), False for the backends that hold Python objects (list, PagedTape)"""
+    return isinstance(tape, array)
+
+
+def can_promote(tape) -> bool:
+    return is_compact(tape)
+
+
+def promote(tape) -> list:
+    """
+    Switch to arbitrary precision storage (a list) once a cell outgrows 64 bits.
+
+    Args:
+        tape: Tape to convert.
+
+    Returns:
+        list: Same cells as a list.
+    """
+    return tape.tolist()
+
+
+def zeros(count: int):
+    """Padding for tape.extend() that works for every backend"""
+    return [0] * count
+
+
+def grow(tape, position: int):
+    """
+    Make the tape long enough to hold position (checkArrSize).
+
+    Args:
+        tape: Tape of any kind.
+        position: Cell that has to exist afterwards.
+    """
+    if isinstance(tape, PagedTape):
+        tape.grow(position)
+    elif position >= len(tape):
+        tape.extend(zeros(position - len(tape) + 1))
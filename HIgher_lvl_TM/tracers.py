@@ -0,0 +1,37 @@
+"""
+Opt-in tracing hooks for HigherLevelTM
+"""
+
+
+class Tracer:
+    """Base tracer, does nothing. Subclass and override whatever you need."""
+
+    def instruction(self, tm, instruction):
+        """Called before every instruction (including the body of a passing IF)"""
+
+    def state(self, tm):
+        """Called after every STATE transition, tm.state is already the new state"""
+
+    def finished(self, tm):
+        """Called once when a run stops (accepted or out of budget)"""
+
+
+class PrintTracer(Tracer):
+    """The classic console output: every instruction and the whole tape on each state change"""
+
+    def instruction(self, tm, instruction):
+        print(instruction.text)
+
+    def state(self, tm):
+        # print(tm.tape[tm.variables["OUTPUT"]:tm.variables["WORK"]])
+        print(list(tm.tape)) # <------------------------------------------------------------ PRINT TAPE
+
+
+class StateCountTracer(Tracer):
+    """Counts how many times each state is entered, cheap enough for batch runs"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def state(self, tm):
+        self.counts[tm.state] = self.counts.get(tm.state, 0) + 1
@@ -0,0 +1,348 @@
+"""
+Benchmark harness for the pi TM and the pi_calculator methods
+
+Every case runs in its own subprocess so its peak RSS (resource.ru_maxrss) is its own, the parent only
+collects the results and writes them as JSON:
+
+    python benchmark.py                          # default sweep, JSON on stdout
+    python benchmark.py --quick -o bench.json    # small sweep, written to bench.json
+    python benchmark.py --compare bench.json     # also flag cases more than 20% slower than bench.json
+
+Cases:
+    tm   HigherLevelTM on generate_pi_tm_macro(n) for every n in TM_DIGITS and (engine, fused loops)
+         in TM_CONFIGS: steps, wall time, steps/sec, peak RSS
+    pi   every method in PI_METHODS for every n in PI_DIGITS: wall time, peak RSS. Methods in
+         PARALLEL_METHODS also run once per process count in PI_WORKERS (--workers 1 2 4 8),
+         "speedup" then holds time with 1 worker / time with N.
+    tm2  low-level/pi30.tm2 for n steps (TM2_STEPS) on every simulator in TM2_ENGINES: the table loop
+         (tm2.py), macro steps (macro_machine.py) and the compiled backend (tm2_codegen.py, Numba if
+         installed, "backend" says which). n is a step budget here, the output is the tape.
+
+Each case is repeated and the fastest run is reported. "scaling" holds the log-log slope of wall time
+(and of steps for the TM) against n for every series, i.e. time ~ n^exponent.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TM_DIR = os.path.join(ROOT, "HIgher_lvl_TM")
+LOW_LEVEL_DIR = os.path.join(ROOT, "low-level")
+
+# --------------------------------------------------------------------------------
+#                    SWEEPS
+# --------------------------------------------------------------------------------
+TM_DIGITS = [33, 100, 200, 400]
+# (engine, fuse loops)
+TM_CONFIGS = [("reference", False), ("reference", True), ("compiled", False), ("compiled", True), ("vm", False), ("vm", True)]
+PI_DIGITS = [100, 300, 1000, 3000]
+PI_METHODS = ["chudnovsky", "binary_splitting", "machin", "machin_like", "simple_spigot"]
+# Process counts for the methods that take workers= (PARALLEL_METHODS), the rest always run with one
+PI_WORKERS = [1]
+PARALLEL_METHODS = ["binary_splitting", "machin_like"]
+TM2_STEPS = [10_000_000, 50_000_000]
+TM2_ENGINES = ["table", "macro", "compiled"]
+TM2_MACHINE = os.path.join(LOW_LEVEL_DIR, "pi30.tm2")
+TM2_BLOCK_SIZE = 8
+REPEAT = 3
+# Seconds before a single run is abandoned and reported as timed out
+TIMEOUT = 600
+# Cases faster than this are too noisy for --compare to call them slower
+MIN_COMPARE_SECONDS = 0.05
+
+QUICK_TM_DIGITS = [33, 100]
+QUICK_PI_DIGITS = [100, 300]
+QUICK_TM2_STEPS = [2_000_000]
+QUICK_REPEAT = 1
+
+
+def run_tm_case(n_digits, engine, fuse_loops):
+    sys.path.insert(0, TM_DIR)
+    import HigherLevelTM
+    from instructions_generator import generate_pi_tm_macro
+
+    tm = HigherLevelTM.HigherLevelTM(generate_pi_tm_macro(n_digits), 0, False, BATCH=True,
+                                     FUSE_LOOPS=fuse_loops, ENGINE=engine)
+    result = tm.run()
+    return {"steps": result.steps, "seconds": result.elapsed, "output": result.output}
+
+
+def run_pi_case(n_digits, method, workers=1):
+    import pi_calculator
+
+    compute = getattr(pi_calculator, f"compute_pi_{method}")
+    options = {"workers": workers} if workers != 1 else {}
+    started = time.perf_counter()
+    output = compute(n_digits, verbose=False, **options)
+    return {"seconds": time.perf_counter() - started, "output": output}
+
+
+def run_tm2_case(steps, engine):
+    sys.path.insert(0, LOW_LEVEL_DIR)
+    import tm2
+
+    started = time.perf_counter()
+    machine = tm2.load_tm2(TM2_MACHINE)
+    if engine == "table":
+        simulator = tm2.TM2Simulator(tm2.compile_tables(machine))
+    elif engine == "macro":
+        import macro_machine
+        simulator = macro_machine.MacroSimulator(tm2.compile_tables(machine), TM2_BLOCK_SIZE)
+    elif engine == "compiled":
+        import tm2_codegen
+        simulator = tm2_codegen.compile_simulator(machine)
+    else:
+        raise ValueError(f"unknown tm2 engine '{engine}'")
+    setup = time.perf_counter() - started
+
+    result = simulator.run(steps)
+    measured = {"steps": result.steps, "seconds": result.elapsed, "setup_seconds": setup, "output": simulator.cells()}
+    if engine == "compiled":
+        measured["backend"] = simulator.backend
+    return measured
+
+
+def run_case(case):
+    """
+    Run one case in this process (the child side of measure()).
+
+    Args:
+        case: {"kind": "tm", "n": ..., "engine": ..., "fuse_loops": ...},
+              {"kind": "pi", "n": ..., "method": ..., "workers": ...} or
+              {"kind": "tm2", "n": ..., "engine": ...}
+
+    Returns:
+        dict: Measurements, output is replaced by its length and sha256 so runs can be compared.
+    """
+    if case["kind"] == "tm":
+        measured = run_tm_case(case["n"], case["engine"], case["fuse_loops"])
+    elif case["kind"] == "pi":
+        measured = run_pi_case(case["n"], case["method"], case.get("workers", 1))
+    elif case["kind"] == "tm2":
+        measured = run_tm2_case(case["n"], case["engine"])
+    else:
+        raise ValueError(f"unknown case kind '{case['kind']}'")
+
+    output = measured.pop("output") or ""
+    measured["output_chars"] = len(output)
+    measured["output_sha256"] = hashlib.sha256(output.encode("ascii")).hexdigest()
+    # Linux reports KiB, macOS bytes. Children are worker processes, their peak is the largest single one.
+    scale = 1024 if sys.platform == "darwin" else 1
+    measured["peak_rss_kib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+    measured["peak_rss_children_kib"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale
+    return measured
+
+
+def measure(case, repeat, timeout=TIMEOUT):
+    """
+    Run a case repeat times, each in a fresh interpreter.
+
+    Args:
+        case: See run_case.
+        repeat: Number of runs, the fastest one is reported.
+        timeout: Seconds before a run is killed.
+
+    Returns:
+        dict: The case merged with the best measurements, or with "error" if a run failed.
+    """
+    runs = []
+    for _ in range(repeat):
+        try:
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)],
+                capture_output=True, text=True, timeout=timeout, cwd=ROOT,
+            )
+        except subprocess.TimeoutExpired:
+            return dict(case, error=f"timed out after {timeout}s")
+        if completed.returncode != 0:
+            return dict(case, error=completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else
+                        f"exit code {completed.returncode}")
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    best = min(runs, key=lambda run: run["seconds"])
+    result = dict(case, **best)
+    result["peak_rss_kib"] = max(run["peak_rss_kib"] for run in runs)
+    result["peak_rss_children_kib"] = max(run["peak_rss_children_kib"] for run in runs)
+    result["repeat"] = repeat
+    if "steps" in result:
+        result["steps_per_sec"] = result["steps"] / result["seconds"] if result["seconds"] > 0 else None
+    return result
+
+
+def scaling_exponent(points):
+    """
+    Least squares slope of log(y) against log(x).
+
+    Args:
+        points: [(x, y)] with positive values.
+
+    Returns:
+        float or None: The exponent, None with fewer than two usable points.
+    """
+    points = [(math.log(x), math.log(y)) for x, y in points if x > 0 and y and y > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if spread == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def series_name(result):
+    if result["kind"] == "tm":
+        return f"tm/{result['engine']}" + ("+fused" if result["fuse_loops"] else "")
+    if result["kind"] == "tm2":
+        return f"tm2/{result['engine']}"
+    workers = result.get("workers", 1)
+    return f"pi/{result['method']}" + (f"x{workers}" if workers != 1 else "")
+
+
+def scaling(results):
+    """Scaling exponents per series, see scaling_exponent"""
+    series = {}
+    for result in results:
+        if "error" not in result:
+            series.setdefault(series_name(result), []).append(result)
+
+    exponents = {}
+    for name, members in series.items():
+        exponents[name] = {"seconds": scaling_exponent([(r["n"], r["seconds"]) for r in members])}
+        if members[0]["kind"] == "tm":
+            exponents[name]["steps"] = scaling_exponent([(r["n"], r["steps"]) for r in members])
+    return exponents
+
+
+def speedups(results):
+    """Wall time with one worker / wall time with N workers, per method and n"""
+    single = {(r["method"], r["n"]): r["seconds"] for r in results
+              if r["kind"] == "pi" and r.get("workers", 1) == 1 and "error" not in r}
+    table = {}
+    for result in results:
+        if result["kind"] != "pi" or result.get("workers", 1) == 1 or "error" in result:
+            continue
+        baseline = single.get((result["method"], result["n"]))
+        if baseline:
+            table.setdefault(result["method"], {}).setdefault(str(result["n"]), {})[str(result["workers"])] = \
+                baseline / result["seconds"]
+    return table
+
+
+def compare(results, baseline_path, tolerance):
+    """
+    Find cases that got slower than in an earlier report.
+
+    Args:
+        results: Results of this run.
+        baseline_path: JSON report written by an earlier run.
+        tolerance: Allowed slowdown as a fraction (0.2 = 20%).
+
+    Returns:
+        list: One entry per regression (slower, different output or a new error).
+    """
+    with open(baseline_path, "r") as f:
+        baseline = {(series_name(r), r["n"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        key = (series_name(result), result["n"])
+        old = baseline.get(key)
+        if old is None or "error" in old:
+            continue
+        if "error" in result:
+            regressions.append({"case": key, "error": result["error"]})
+        elif result["output_sha256"] != old["output_sha256"]:
+            regressions.append({"case": key, "output_changed": True})
+        elif result["seconds"] > old["seconds"] * (1 + tolerance) and result["seconds"] >= MIN_COMPARE_SECONDS:
+            regressions.append({"case": key, "seconds": result["seconds"], "baseline_seconds": old["seconds"],
+                                "slowdown": result["seconds"] / old["seconds"]})
+    return regressions
+
+
+def cases(tm_digits, pi_digits, methods, pi_workers, tm2_steps):
+    for engine, fuse_loops in TM_CONFIGS:
+        for n in tm_digits:
+            yield {"kind": "tm", "n": n, "engine": engine, "fuse_loops": fuse_loops}
+    for method in methods:
+        for workers in (pi_workers if method in PARALLEL_METHODS else [1]):
+            for n in pi_digits:
+                yield {"kind": "pi", "n": n, "method": method, "workers": workers}
+    for engine in TM2_ENGINES:
+        for n in tm2_steps:
+            yield {"kind": "tm2", "n": n, "engine": engine}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=ROOT).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit or None,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pi TM and the pi_calculator methods")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--quick", action="store_true", help="small sweep for a fast smoke run")
+    parser.add_argument("--repeat", type=int, help=f"runs per case (default {REPEAT})")
+    parser.add_argument("--tm-digits", type=int, nargs="*", help="digit counts for the TM sweep")
+    parser.add_argument("--pi-digits", type=int, nargs="*", help="digit counts for the pi_calculator sweep")
+    parser.add_argument("--methods", nargs="*", choices=PI_METHODS, help="pi_calculator methods to run")
+    parser.add_argument("--tm2-steps", type=int, nargs="*", help="step budgets for the pi30.tm2 sweep")
+    parser.add_argument("--workers", type=int, nargs="*", help=f"process counts for {', '.join(PARALLEL_METHODS)}")
+    parser.add_argument("--compare", metavar="REPORT", help="earlier JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown for --compare (default 0.2)")
+    parser.add_argument("--case", help=argparse.SUPPRESS)  # internal: run one case and print its JSON
+    args = parser.parse_args()
+
+    if args.case is not None:
+        sys.path.insert(0, ROOT)
+        print(json.dumps(run_case(json.loads(args.case))))
+        return 0
+
+    tm_digits = args.tm_digits if args.tm_digits is not None else (QUICK_TM_DIGITS if args.quick else TM_DIGITS)
+    pi_digits = args.pi_digits if args.pi_digits is not None else (QUICK_PI_DIGITS if args.quick else PI_DIGITS)
+    methods = args.methods if args.methods is not None else PI_METHODS
+    pi_workers = args.workers or PI_WORKERS
+    tm2_steps = args.tm2_steps if args.tm2_steps is not None else (QUICK_TM2_STEPS if args.quick else TM2_STEPS)
+    repeat = args.repeat or (QUICK_REPEAT if args.quick else REPEAT)
+
+    results = []
+    for case in cases(tm_digits, pi_digits, methods, pi_workers, tm2_steps):
+        result = measure(case, repeat)
+        results.append(result)
+        status = result.get("error") or f"{result['seconds']:.3f}s, {result['peak_rss_kib']} KiB"
+        print(f"{series_name(case)} n={case['n']}: {status}", file=sys.stderr)
+
+    report = {"environment": environment(), "results": results, "scaling": scaling(results),
+              "speedup": speedups(results)}
+    if args.compare:
+        report["regressions"] = compare(results, args.compare, args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""
+Macro-step simulator for .tm2 machines: run-length tape, sweep skipping and memoized block steps
+
+Laconic machines spend almost all of their time sweeping the head across unary data (on pi30 ~94% of
+steps are "x -> same state; R/L; y" self-loops), so stepping cell by cell mostly repeats itself.
+MacroSimulator runs the same compiled Tables as tm2.TM2Simulator with the same steps, tape and
+head position at every stop, but:
+
+Blocks: the tape is cut into blocks of block_size cells, aligned on cell 0. The machine is always
+either on a block edge, about to enter the next block from the left or from the right, or inside a
+block (after HALT/ERROR or when a budget ran out there).
+
+Memoized block steps: entering block X in state s from one side, the machine runs inside X until it
+leaves on either side (or halts, or loops forever). The result (state, new block contents, exit side,
+steps) only depends on (s, X, side), so it is computed once with plain steps and looked up afterwards.
+
+Run-length tape: the tape left and right of the head are two stacks of [block, count] runs, the top
+of each stack next to the head and blank blocks beyond the bottoms.
+
+Sweep skipping: if entering X from the left in state s comes out on the right in state s again
+(block_size 1: "x -> s; R; y"), the same happens for every X of the run, so a run of n X blocks
+becomes n Y blocks on the other side in one operation, n times the steps. Same for right to left.
+
+Anything that wouldn't fit in the remaining budget (or loops inside a block) falls back to plain steps
+inside that block, so budgets stop on exactly the same step as tm2.TM2Simulator.
+
+    python tm2.py pi30.tm2 --block-size 8 --seconds 60
+"""
+import time
+
+from tm2 import HALTED, ERRORED, OUT_OF_BUDGET, RunResult
+
+RIGHT = 1
+LEFT = -1
+
+
+def _block_steps(tables, base, cells, offset, limit):
+    """
+    Plain steps on one block until the head leaves it, HALT/ERROR or limit steps.
+
+    Args:
+        tables: tm2.Tables.
+        base: Base of the current state.
+        cells: bytearray with the block's symbol numbers, updated in place.
+        offset: Head position inside the block.
+        limit: Max number of steps.
+
+    Returns:
+        tuple: (base, offset, steps). offset is -1 or len(cells) if the head left the block.
+    """
+    table, shift, mask, move_bits, move_mask = tables.table, tables.shift, tables.mask, tables.move_bits, tables.move_mask
+    end = len(table)
+    size = len(cells)
+    steps = 0
+    while steps < limit and 0 <= offset < size and base < end:
+        entry = table[base + cells[offset]]
+        cells[offset] = (entry >> move_bits) & mask
+        offset += (entry & move_mask) - 1
+        base = entry >> shift
+        steps += 1
+    return base, offset, steps
+
+
+def _push(stack, block, count, blank):
+    # blanks pushed onto an empty stack are already there, beyond the bottom
+    if stack:
+        top = stack[-1]
+        if top[0] == block:
+            top[1] += count
+            return
+    elif block == blank:
+        return
+    stack.append([block, count])
+
+
+def _pop(stack, count, blank):
+    # removes count blocks from the top run, which has at least that many (or is the blank beyond the bottom)
+    if stack:
+        top = stack[-1]
+        top[1] -= count
+        if not top[1]:
+            stack.pop()
+        return top[0]
+    return blank
+
+
+class MacroSimulator:
+    """
+    Runs compiled Tables with macro steps, see the module docstring.
+
+    Attributes:
+        block_size: Cells per block.
+        left, right: Run stacks, [block (bytes), count] with the top next to the head.
+        direction: RIGHT (entering right's top block from the left) or LEFT (entering left's top from the right).
+        boundary: Cell index where the right stack starts.
+        inside: (bytearray, offset) of the block the head is in, None when on a block edge.
+        base: Base of the current state.
+        steps: Steps executed so far, elapsed: seconds spent running them.
+        cache: {(base, block, direction): (base, block, offset, steps, exit direction, boundary change)},
+            steps None = never leaves the block, exit direction None = stopped (HALT/ERROR) inside it.
+        macro_steps: Number of cache lookups (each one is a block step or a whole sweep).
+    """
+
+    def __init__(self, tables, block_size=1):
+        if block_size < 1:
+            raise ValueError(f"block_size has to be at least 1, got {block_size}")
+        if tables.max_move != 1:
+            raise ValueError(f"blocks are entered one cell at a time, moves of {tables.max_move} cells aren't supported")
+        self.tables = tables
+        self.block_size = block_size
+        self.blank = bytes(block_size)
+        self.left = []
+        self.right = []
+        self.direction = RIGHT
+        self.boundary = 0
+        self.inside = None
+        self.base = tables.start
+        self.steps = 0
+        self.elapsed = 0.0
+        self.cache = {}
+        self.macro_steps = 0
+        # no state sequence inside a block can be longer than this without repeating
+        self.cycle_limit = len(tables.table) * len(tables.symbols) ** block_size * block_size + 1
+
+    @property
+    def state(self) -> str:
+        return self.tables.state_name(self.base)
+
+    @property
+    def status(self):
+        if self.base == self.tables.halt:
+            return HALTED
+        if self.base == self.tables.error:
+            return ERRORED
+        return None
+
+    def position(self) -> int:
+        if self.inside is not None:
+            return self.boundary + self.inside[1]
+        return self.boundary if self.direction == RIGHT else self.boundary - 1
+
+    def _lookup(self, block):
+        cells = bytearray(block)
+        offset = 0 if self.direction == RIGHT else self.block_size - 1
+        base, offset, steps = _block_steps(self.tables, self.base, cells, offset, self.cycle_limit)
+        if steps == self.cycle_limit:
+            steps = None
+        exit_direction = RIGHT if offset >= self.block_size else LEFT if offset < 0 else None
+        # how far the boundary moves: entering from the right pops the block off the left stack,
+        # leaving on the right pushes it onto the left stack
+        moved = (self.block_size if exit_direction == RIGHT else 0) - (self.block_size if self.direction == LEFT else 0)
+        result = self.cache[(self.base, block, self.direction)] = (base, bytes(cells), offset, steps, exit_direction, moved)
+        return result
+
+    def _enter(self, block):
+        # pop the next block into self.inside, the head on its entry cell
+        if self.direction == RIGHT:
+            _pop(self.right, 1, self.blank)
+            self.inside = (bytearray(block), 0)
+        else:
+            _pop(self.left, 1, self.blank)
+            self.boundary -= self.block_size
+            self.inside = (bytearray(block), self.block_size - 1)
+
+    def _leave(self, block, offset):
+        # put the block back on the side the head left it to
+        if offset < 0:
+            _push(self.right, block, 1, self.blank)
+            self.direction = LEFT
+        else:
+            _push(self.left, block, 1, self.blank)
+            self.boundary += self.block_size
+            self.direction = RIGHT
+        self.inside = None
+
+    def _plain(self, limit) -> int:
+        # plain steps inside the current block
+        cells, offset = self.inside
+        self.base, offset, steps = _block_steps(self.tables, self.base, cells, offset, limit)
+        if 0 <= offset < self.block_size:
+            self.inside = (cells, offset)
+        else:
+            self._leave(bytes(cells), offset)
+        return steps
+
+    def run(self, budget=None) -> RunResult:
+        """
+        Run until HALT, ERROR or budget steps, same as tm2.TM2Simulator.run.
+        """
+        remaining = float("inf") if budget is None else budget
+        executed = 0
+        macro_steps = 0
+        size = self.block_size
+        end = len(self.tables.table)
+        cache, left, right, blank = self.cache, self.left, self.right, self.blank
+        started = time.perf_counter()
+        while self.base < end and remaining > 0:
+            if self.inside is not None:
+                done = self._plain(remaining)
+                executed += done
+                remaining -= done
+                continue
+
+            direction = self.direction
+            ahead = right if direction == RIGHT else left
+            if ahead:
+                top = ahead[-1]
+                block = top[0]
+            else:
+                top = None
+                block = blank
+            entry = cache.get((self.base, block, direction)) or self._lookup(block)
+            base, after, offset, steps, exit_direction, moved = entry
+            macro_steps += 1
+            if steps is None or steps > remaining:
+                self._enter(block)
+                continue
+
+            if exit_direction is None:
+                # halted inside the block
+                self._enter(block)
+                self.base = base
+                self.inside = (bytearray(after), offset)
+                done = steps
+            elif base == self.base and exit_direction == direction:
+                # sweep: every block of the run does the same
+                if top is not None:
+                    count = top[1] if budget is None else min(top[1], remaining // steps)
+                elif budget is not None:
+                    count = remaining // steps
+                else:
+                    raise RuntimeError(f"state {self.state} sweeps over blank tape forever")
+                _pop(ahead, count, blank)
+                _push(left if direction == RIGHT else right, after, count, blank)
+                self.boundary += count * size * direction
+                done = count * steps
+            else:
+                if top is not None:
+                    top[1] -= 1
+                    if not top[1]:
+                        ahead.pop()
+                _push(left if exit_direction == RIGHT else right, after, 1, blank)
+                self.boundary += moved
+                self.base = base
+                self.direction = exit_direction
+                done = steps
+            executed += done
+            remaining -= done
+
+        self.steps += executed
+        self.macro_steps += macro_steps
+        elapsed = time.perf_counter() - started
+        self.elapsed += elapsed
+        return RunResult(self.status or OUT_OF_BUDGET, executed, self.steps, elapsed)
+
+    def steps_per_second(self) -> float:
+        return self.steps / self.elapsed if self.elapsed else 0.0
+
+    def cells(self) -> str:
+        """Written part of the tape (blank-trimmed on both ends) as symbols, same as TM2Simulator.cells"""
+        data = bytearray()
+        for block, count in self.left:
+            data += block * count
+        if self.inside is not None:
+            data += self.inside[0]
+        for block, count in reversed(self.right):
+            data += block * count
+        used = data.strip(b"\x00")
+        return "".join(self.tables.symbols[cell] for cell in used) if used else ""
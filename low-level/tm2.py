@@ -0,0 +1,370 @@
+"""
+Loader and simulator for the .tm2 machines in this folder (pi30.tm2)
+
+Format, as written by the Laconic compiler:
+
+    States: 5773
+
+    START start_read_:
+    	a -> start_write_next; R; b
+    	b -> ERROR; -; b
+
+    name:
+    	<read symbol> -> <next state>; <move L, R or - for none>; <write symbol>
+
+Moves can also carry a cell count, R3 or L2 (written by tm2_optimize.py when it folds chains of
+move-only states into one transition), plain L/R are one cell.
+
+The block marked START is the first state, HALT and ERROR are the two special states (they have no
+block, entering one stops the machine). The tape starts out blank on both sides, the blank is the
+first symbol read in the file ("a" for pi30).
+
+compile_tables() turns a machine into one flat integer table, indexed by state base + symbol where
+every state's base is its number times the symbol count. An entry packs everything a step needs:
+
+    entry = next base << (move bits + symbol bits) | write symbol << move bits | move + max move
+
+(move bits = 2 and max move = 1 for plain L/R machines) so a step is one table lookup and three
+shifts/masks. HALT and ERROR get bases past the end of the
+table: the lookup after entering them raises IndexError, which ends the run without an extra check
+per step. The tape is a bytearray holding symbol numbers (blank = 0) that grows in both directions.
+The head moves at most max move cells per step, so the simulator runs as many steps as fit in the
+distance to the nearest end without any bounds checks, then grows the tape if it got close.
+
+The table is a plain list of ints rather than NumPy or array('q'): the loop reads it one element at a
+time from Python, and a list hands back the int it holds while array/NumPy box a new one on every
+read (array('q') measured ~30% slower on pi30, NumPy scalar access is slower still).
+
+    python tm2.py pi30.tm2 --budget 100000000
+    python tm2.py pi30.tm2 --seconds 60
+    python tm2.py pi30.tm2 --block-size 8 --seconds 60    # macro steps, see macro_machine.py
+    python tm2.py pi30.tm2 --compile auto --seconds 60    # generated code or Numba, see tm2_codegen.py
+"""
+import argparse
+import re
+import time
+from collections import namedtuple
+
+HALT = "HALT"
+ERROR = "ERROR"
+SPECIAL = (HALT, ERROR)
+MOVES = {"L": -1, "R": 1, "-": 0}
+
+# Run results
+HALTED = "halted"
+ERRORED = "error"
+OUT_OF_BUDGET = "out_of_budget"
+
+# Initial tape size and the smallest number of steps run between bounds checks
+INITIAL_CELLS = 1 << 16
+MIN_CHUNK = 1 << 12
+
+Transition = namedtuple("Transition", ["next", "move", "write"])
+Machine = namedtuple("Machine", ["start", "symbols", "states"])
+RunResult = namedtuple("RunResult", ["status", "steps", "total_steps", "elapsed"])
+
+_HEADER = re.compile(r"States:\s*(\d+)$")
+_STATE = re.compile(r"(START\s+)?(\S+):$")
+_TRANSITION = re.compile(r"(\S+)\s*->\s*([^;\s]+)\s*;\s*([LR]\d*|-)\s*;\s*(\S+)$")
+
+
+def parse_move(text) -> int:
+    """L, R, - or L<n>/R<n> as a signed cell count"""
+    if len(text) > 1:
+        return MOVES[text[0]] * int(text[1:])
+    return MOVES[text]
+
+
+def format_move(move) -> str:
+    """Inverse of parse_move"""
+    if move == 0:
+        return "-"
+    name = "R" if move > 0 else "L"
+    return name if abs(move) == 1 else f"{name}{abs(move)}"
+
+
+def parse_tm2(text):
+    """
+    Parse a .tm2 machine.
+
+    Args:
+        text: Contents of the .tm2 file.
+
+    Returns:
+        Machine: start state name, symbols (blank first) and {state: {symbol: Transition}} in file order.
+    """
+    declared = None
+    start = None
+    state = None
+    symbols = []
+    states = {}
+    for number, line in enumerate(text.splitlines(), start=1):
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        match = _TRANSITION.match(stripped)
+        if match:
+            if state is None:
+                raise ValueError(f"line {number}: transition outside of a state block")
+            read, target, move, write = match.groups()
+            if read in states[state]:
+                raise ValueError(f"line {number}: state '{state}' has two transitions for '{read}'")
+            for symbol in (read, write):
+                if symbol not in symbols:
+                    symbols.append(symbol)
+            states[state][read] = Transition(target, parse_move(move), write)
+            continue
+
+        match = _HEADER.match(stripped)
+        if match and declared is None and not states:
+            declared = int(match.group(1))
+            continue
+
+        match = _STATE.match(stripped)
+        if match:
+            state = match.group(2)
+            if state in states or state in SPECIAL:
+                raise ValueError(f"line {number}: state '{state}' defined twice")
+            states[state] = {}
+            if match.group(1):
+                if start is not None:
+                    raise ValueError(f"line {number}: second START state '{state}'")
+                start = state
+            continue
+
+        raise ValueError(f"line {number}: can't parse '{stripped}'")
+
+    if start is None:
+        raise ValueError("no START state")
+    if declared is not None and declared != len(states):
+        raise ValueError(f"header says {declared} states but {len(states)} are defined")
+    for name, transitions in states.items():
+        for read, transition in transitions.items():
+            if transition.next not in states and transition.next not in SPECIAL:
+                raise ValueError(f"state '{name}' on '{read}' goes to undefined state '{transition.next}'")
+    return Machine(start, symbols, states)
+
+
+def load_tm2(path):
+    """
+    Load a .tm2 file, see parse_tm2.
+    """
+    with open(path, "r") as f:
+        return parse_tm2(f.read())
+
+
+class Tables:
+    """
+    A machine compiled to the flat transition table described in the module docstring.
+
+    Attributes:
+        names: State names by state number, followed by HALT and ERROR.
+        symbols: Symbols by symbol number, blank first.
+        table: List of packed entries, (len(names) - 2) states * len(symbols).
+        start: Base of the start state.
+        halt, error: Bases of HALT and ERROR (both >= len(table)).
+        max_move: Most cells any transition moves (at least 1).
+        shift, mask, move_bits, move_mask: Entry decoding, base = entry >> shift,
+            write = (entry >> move_bits) & mask, move = (entry & move_mask) - max_move.
+    """
+
+    def __init__(self, machine):
+        self.names = list(machine.states) + list(SPECIAL)
+        self.symbols = list(machine.symbols)
+        width = len(self.symbols)
+        bits = max(1, (width - 1).bit_length())
+        self.max_move = max([1] + [abs(t.move) for transitions in machine.states.values() for t in transitions.values()])
+        self.move_bits = (2 * self.max_move).bit_length()
+        self.move_mask = (1 << self.move_bits) - 1
+        self.shift = self.move_bits + bits
+        self.mask = (1 << bits) - 1
+
+        bases = {name: number * width for number, name in enumerate(self.names)}
+        symbol_ids = {symbol: number for number, symbol in enumerate(self.symbols)}
+        self.start = bases[machine.start]
+        self.halt = bases[HALT]
+        self.error = bases[ERROR]
+
+        self.table = []
+        for name, transitions in machine.states.items():
+            for read in self.symbols:
+                # a symbol the state has no transition for is an error that leaves the cell alone
+                transition = transitions.get(read, Transition(ERROR, 0, read))
+                self.table.append(
+                    (bases[transition.next] << self.shift) | (symbol_ids[transition.write] << self.move_bits)
+                    | (transition.move + self.max_move)
+                )
+
+    def state_name(self, base) -> str:
+        return self.names[base // len(self.symbols)]
+
+
+def compile_tables(machine) -> Tables:
+    """
+    Compile a parsed machine into integer transition tables.
+
+    Args:
+        machine: Machine from parse_tm2/load_tm2.
+
+    Returns:
+        Tables: The compiled machine.
+    """
+    return Tables(machine)
+
+
+def _run_chunk(table, tape, h, base, count, tables):
+    """
+    Run up to count steps without bounds checks, the caller makes sure the head can't leave the tape.
+
+    Returns:
+        tuple: (steps executed, head, base). Fewer than count steps means HALT or ERROR was entered.
+    """
+    shift, mask, move_bits, move_mask, bias = tables.shift, tables.mask, tables.move_bits, tables.move_mask, tables.max_move
+    i = 0
+    try:
+        for i in range(count):
+            entry = table[base + tape[h]]
+            tape[h] = (entry >> move_bits) & mask
+            h += (entry & move_mask) - bias
+            base = entry >> shift
+    except IndexError:
+        # the lookup after entering HALT/ERROR, nothing of step i was done
+        return i, h, base
+    return count, h, base
+
+
+class TM2Simulator:
+    """
+    Runs compiled Tables on a bytearray tape.
+
+    Attributes:
+        tape: bytearray of symbol numbers, cell 0 (where the head started) is at index origin.
+        head: Head index into tape (position() gives it relative to cell 0).
+        base: Base of the current state.
+        steps: Steps executed so far, elapsed: seconds spent running them.
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.tape = bytearray(INITIAL_CELLS)
+        self.origin = INITIAL_CELLS // 2
+        self.head = self.origin
+        self.base = tables.start
+        self.steps = 0
+        self.elapsed = 0.0
+
+    @property
+    def state(self) -> str:
+        return self.tables.state_name(self.base)
+
+    @property
+    def status(self):
+        if self.base == self.tables.halt:
+            return HALTED
+        if self.base == self.tables.error:
+            return ERRORED
+        return None
+
+    def position(self) -> int:
+        return self.head - self.origin
+
+    def _grow(self):
+        # double the tape (at least), on the side(s) the head is close to
+        size = max(len(self.tape), 2 * MIN_CHUNK * self.tables.max_move)
+        if self.head < MIN_CHUNK * self.tables.max_move:
+            self.tape[0:0] = bytes(size)
+            self.head += size
+            self.origin += size
+        if len(self.tape) - 1 - self.head < MIN_CHUNK * self.tables.max_move:
+            self.tape.extend(bytes(size))
+
+    def _chunk(self, count):
+        # count steps that can't leave the tape -> (steps, head, base)
+        return _run_chunk(self.tables.table, self.tape, self.head, self.base, count, self.tables)
+
+    def run(self, budget=None) -> RunResult:
+        """
+        Run until HALT, ERROR or budget steps.
+
+        Args:
+            budget: Max number of steps for this call (None = no limit).
+
+        Returns:
+            RunResult: status (HALTED, ERRORED or OUT_OF_BUDGET), steps of this call, total steps and
+            elapsed seconds of this call.
+        """
+        tables = self.tables
+        remaining = float("inf") if budget is None else budget
+        executed = 0
+        started = time.perf_counter()
+        while self.status is None and remaining > 0:
+            room = min(self.head, len(self.tape) - 1 - self.head) // tables.max_move
+            if room < MIN_CHUNK and room < remaining:
+                self._grow()
+                room = min(self.head, len(self.tape) - 1 - self.head) // tables.max_move
+            count = min(room, remaining)
+            done, self.head, self.base = self._chunk(count)
+            executed += done
+            remaining -= done
+            self.steps += done
+        elapsed = time.perf_counter() - started
+        self.elapsed += elapsed
+        return RunResult(self.status or OUT_OF_BUDGET, executed, self.steps, elapsed)
+
+    def steps_per_second(self) -> float:
+        return self.steps / self.elapsed if self.elapsed else 0.0
+
+    def cells(self) -> str:
+        """Written part of the tape (blank-trimmed on both ends) as symbols"""
+        used = self.tape.strip(b"\x00")
+        return "".join(self.tables.symbols[cell] for cell in used) if used else ""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a .tm2 Turing machine")
+    parser.add_argument("path", help=".tm2 file")
+    parser.add_argument("--budget", type=int, default=None, help="max number of steps (default: until HALT)")
+    parser.add_argument("--seconds", type=float, default=None, help="stop after this much wall time")
+    parser.add_argument("--slice", type=int, default=10_000_000, help="steps between progress reports")
+    parser.add_argument("--tape", action="store_true", help="print the written part of the tape at the end")
+    parser.add_argument("--block-size", type=int, default=None,
+                        help="run with macro steps over blocks of this many cells (macro_machine.py)")
+    parser.add_argument("--compile", choices=("auto", "python", "numba"), default=None,
+                        help="run a compiled backend (tm2_codegen.py)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    machine = load_tm2(args.path)
+    tables = compile_tables(machine)
+    print(f"loaded {len(machine.states)} states, symbols {machine.symbols} in {time.perf_counter() - started:.3f}s")
+
+    # macro_machine and tm2_codegen import this module, so they're imported here and not at the top
+    if args.block_size is not None:
+        import macro_machine
+        simulator = macro_machine.MacroSimulator(tables, args.block_size)
+    elif args.compile is not None:
+        import tm2_codegen
+        simulator = tm2_codegen.compile_simulator(machine, args.compile)
+    else:
+        simulator = TM2Simulator(tables)
+    deadline = None if args.seconds is None else time.perf_counter() + args.seconds
+    while True:
+        remaining = None if args.budget is None else args.budget - simulator.steps
+        step = args.slice if remaining is None else min(args.slice, remaining)
+        result = simulator.run(step)
+        print(f"{simulator.steps:,} steps, {simulator.steps_per_second():,.0f} steps/sec, state {simulator.state}, "
+              f"head {simulator.position()}")
+        if result.status != OUT_OF_BUDGET or remaining == result.steps:
+            break
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+
+    print(f"{simulator.status or OUT_OF_BUDGET} after {simulator.steps:,} steps in {simulator.elapsed:.3f}s "
+          f"({simulator.steps_per_second():,.0f} steps/sec)")
+    if args.tape:
+        print(simulator.cells())
+
+
+if __name__ == "__main__":
+    main()
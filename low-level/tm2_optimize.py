@@ -0,0 +1,300 @@
+"""
+Offline optimizer for .tm2 machines
+
+Takes a machine apart the way the Laconic compiler builds it and writes back a smaller one that does
+the same thing, in three passes:
+
+Unreachable states: anything not reachable from START through the transitions is dropped.
+
+Move chains: a state whose transitions all keep the symbol and move the same way to the same next
+state (write_var_counter_H_move: "a -> X; R; a", "b -> X; R; b") does nothing but move. Every
+transition into it can do that move itself and go straight to X, so "T -> M; L; b" with M moving
+right becomes "T -> X; -; b". Chains fold into one multi-cell move (R2, L3, see tm2.parse_move) and
+the move-only states become unreachable. Each fold saves one step every time the transition is taken,
+the tape and head after it are the same as the original's after the whole chain.
+
+Equivalent states: partition refinement (Moore). States start out grouped by what they write and how
+they move on every symbol and move to HALT/ERROR, then groups are split until every state in a group
+goes to the same groups on every symbol. Each group becomes its first state. Merging doesn't change
+a single step, only the number of states.
+
+check() runs the original and the optimized machine side by side and confirms they reach the same
+configuration, and by how many steps fewer:
+
+    python tm2_optimize.py pi30.tm2 -o pi30_optimized.tm2 --check 2000000
+"""
+import argparse
+import time
+from collections import namedtuple, defaultdict
+
+import tm2
+
+Report = namedtuple("Report", ["states", "unreachable", "folded_transitions", "move_states", "merged", "optimized_states"])
+CheckResult = namedtuple("CheckResult", ["ok", "original_steps", "optimized_steps"])
+
+
+def reachable(machine) -> set:
+    """
+    States reachable from START.
+
+    Args:
+        machine: tm2.Machine.
+
+    Returns:
+        set: State names (HALT/ERROR not included).
+    """
+    seen = {machine.start}
+    pending = [machine.start]
+    while pending:
+        for transition in machine.states[pending.pop()].values():
+            if transition.next not in seen and transition.next not in tm2.SPECIAL:
+                seen.add(transition.next)
+                pending.append(transition.next)
+    return seen
+
+
+def remove_unreachable(machine):
+    """
+    Drop every state reachable() doesn't find.
+
+    Returns:
+        tm2.Machine: The machine without them, states in the original order.
+    """
+    keep = reachable(machine)
+    return machine._replace(states={name: t for name, t in machine.states.items() if name in keep})
+
+
+def _pure_move(machine, name):
+    # (next, move) if the state only moves, None otherwise
+    transitions = machine.states[name]
+    if len(transitions) != len(machine.symbols):
+        return None
+    if any(transition.write != read for read, transition in transitions.items()):
+        return None
+    targets = {(transition.next, transition.move) for transition in transitions.values()}
+    return targets.pop() if len(targets) == 1 else None
+
+
+def collapse_moves(machine):
+    """
+    Fold move-only states into the transitions that lead to them, see the module docstring.
+    The move-only states themselves stay until remove_unreachable.
+
+    Returns:
+        tuple: (tm2.Machine, number of transitions that were folded).
+    """
+    pure = {}
+    for name in machine.states:
+        move = _pure_move(machine, name)
+        if move is not None:
+            pure[name] = move
+
+    folded = 0
+    states = {}
+    for name, transitions in machine.states.items():
+        states[name] = {}
+        for read, transition in transitions.items():
+            target, move = transition.next, transition.move
+            seen = set()
+            # stop on a cycle of move-only states, it runs forever either way
+            while target in pure and target not in seen:
+                seen.add(target)
+                target, extra = pure[target]
+                move += extra
+            if seen:
+                folded += 1
+            states[name][read] = tm2.Transition(target, move, transition.write)
+    return machine._replace(states=states), folded
+
+
+def equivalence_classes(machine) -> dict:
+    """
+    Partition refinement over the states of a machine.
+
+    Returns:
+        dict: {state: class number}, equal numbers behave the same from any tape.
+    """
+    def signature(transitions, classes):
+        return tuple(
+            None if transition is None else
+            (transition.write, transition.move,
+             transition.next if transition.next in tm2.SPECIAL else classes[transition.next])
+            for transition in (transitions.get(symbol) for symbol in machine.symbols)
+        )
+
+    # one class to start with, the first round then splits by writes, moves and HALT/ERROR targets
+    classes = {name: 0 for name in machine.states}
+    count = 1
+    while True:
+        numbers = {}
+        refined = {}
+        for name, transitions in machine.states.items():
+            key = (classes[name], signature(transitions, classes))
+            refined[name] = numbers.setdefault(key, len(numbers))
+        classes = refined
+        if len(numbers) == count:
+            return classes
+        count = len(numbers)
+
+
+def merge_equivalent(machine):
+    """
+    Replace every group of equivalent states by its first state.
+
+    Returns:
+        tuple: (tm2.Machine, {state: representative} for every state of the input).
+    """
+    classes = equivalence_classes(machine)
+    first = {}
+    for name in machine.states:
+        first.setdefault(classes[name], name)
+    representative = {name: first[classes[name]] for name in machine.states}
+
+    def rename(state):
+        return state if state in tm2.SPECIAL else representative[state]
+
+    states = {}
+    for name, transitions in machine.states.items():
+        if representative[name] == name:
+            states[name] = {
+                read: transition._replace(next=rename(transition.next)) for read, transition in transitions.items()
+            }
+    return tm2.Machine(rename(machine.start), machine.symbols, states), representative
+
+
+def optimize(machine, collapse=True):
+    """
+    Run all passes.
+
+    Args:
+        machine: tm2.Machine.
+        collapse: Fold move-only states (gives multi-cell moves, which macro_machine can't run).
+
+    Returns:
+        tuple: (optimized tm2.Machine, Report, {original state: optimized state or None if it was removed}).
+    """
+    states = len(machine.states)
+    current = remove_unreachable(machine)
+    unreachable = states - len(current.states)
+
+    folded = 0
+    move_states = 0
+    if collapse:
+        before = len(current.states)
+        current, folded = collapse_moves(current)
+        current = remove_unreachable(current)
+        move_states = before - len(current.states)
+
+    kept = set(current.states)
+    current, representative = merge_equivalent(current)
+    state_map = {name: representative[name] if name in kept else None for name in machine.states}
+
+    report = Report(states, unreachable, folded, move_states, len(kept) - len(current.states), len(current.states))
+    return current, report, state_map
+
+
+def format_tm2(machine) -> str:
+    """
+    Write a machine in the .tm2 format parse_tm2 reads.
+    """
+    lines = [f"States: {len(machine.states)}", ""]
+    for name, transitions in machine.states.items():
+        lines.append(f"START {name}:" if name == machine.start else f"{name}:")
+        for read, transition in transitions.items():
+            lines.append(f"\t{read} -> {transition.next}; {tm2.format_move(transition.move)}; {transition.write}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def _trace(tables, steps, removed):
+    """
+    Run tables for steps steps (then on until the machine isn't in a removed state) on a dict tape.
+
+    Returns:
+        tuple: (steps, steps taken from removed states, base, head, tape).
+    """
+    table, shift, mask, move_bits, move_mask, bias = (
+        tables.table, tables.shift, tables.mask, tables.move_bits, tables.move_mask, tables.max_move)
+    width = len(tables.symbols)
+    end = len(table)
+    tape = defaultdict(int)
+    h = 0
+    base = tables.start
+    executed = 0
+    skipped = 0
+    while base < end and (executed < steps or removed[base // width]):
+        if removed[base // width]:
+            skipped += 1
+        entry = table[base + tape[h]]
+        tape[h] = (entry >> move_bits) & mask
+        h += (entry & move_mask) - bias
+        base = entry >> shift
+        executed += 1
+    return executed, skipped, base, h, tape
+
+
+def check(original, optimized, state_map, steps) -> CheckResult:
+    """
+    Run both machines and compare where they end up.
+
+    The original runs steps steps (plus however many it takes to leave a removed move-only state), the
+    optimized machine runs that many minus the steps the original spent in removed states. Both have
+    to be in corresponding states with the same head position and tape.
+
+    Returns:
+        CheckResult: ok, steps of the original and of the optimized machine.
+    """
+    tables = tm2.compile_tables(original)
+    removed = [state_map.get(name) is None for name in tables.names[:-len(tm2.SPECIAL)]]
+    executed, skipped, base, h, tape = _trace(tables, steps, removed)
+
+    simulator = tm2.TM2Simulator(tm2.compile_tables(optimized))
+    simulator.run(executed - skipped)
+
+    state = tables.state_name(base)
+    written = [position for position, cell in tape.items() if cell]
+    cells = "".join(tables.symbols[tape[position]] for position in range(min(written), max(written) + 1)) if written else ""
+    ok = (
+        simulator.steps == executed - skipped
+        and (state_map.get(state) or state) == simulator.state
+        and simulator.position() == h
+        and simulator.cells() == cells
+    )
+    return CheckResult(ok, executed, simulator.steps)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Optimize a .tm2 Turing machine")
+    parser.add_argument("path", help=".tm2 file")
+    parser.add_argument("-o", "--output", help="write the optimized machine here")
+    parser.add_argument("--no-collapse", action="store_true", help="don't fold move-only states (keeps plain L/R moves)")
+    parser.add_argument("--check", type=int, default=0, metavar="STEPS",
+                        help="run both machines for this many steps and compare")
+    args = parser.parse_args(argv)
+
+    machine = tm2.load_tm2(args.path)
+    started = time.perf_counter()
+    optimized, report, state_map = optimize(machine, collapse=not args.no_collapse)
+    print(f"optimized in {time.perf_counter() - started:.3f}s")
+    print(f"states:              {report.states}")
+    print(f"unreachable:         -{report.unreachable}")
+    print(f"move-only states:    -{report.move_states} ({report.folded_transitions} transitions folded)")
+    print(f"equivalent states:   -{report.merged}")
+    print(f"optimized states:    {report.optimized_states} ({100 * (1 - report.optimized_states / report.states):.1f}% fewer)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(format_tm2(optimized))
+        print(f"wrote {args.output}")
+
+    if args.check:
+        result = check(machine, optimized, state_map, args.check)
+        saved = 1 - result.optimized_steps / result.original_steps
+        print(f"check: {'same configuration' if result.ok else 'MISMATCH'} after {result.original_steps:,} original "
+              f"steps = {result.optimized_steps:,} optimized steps ({100 * saved:.1f}% fewer)")
+        if not result.ok:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
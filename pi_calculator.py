@@ -2,7 +2,23 @@
 Pi Calculator Demo
 """
 
-from decimal import Decimal, getcontext
+import asyncio
+import functools
+import itertools
+import math
+import mmap
+import os
+import pickle
+import random
+import sys
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, Context, localcontext, MAX_PREC, MAX_EMAX, MIN_EMIN, ROUND_FLOOR
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
 
 
 def compute_pi_chudnovsky(n_digits=33, verbose=True):
@@ -12,27 +28,28 @@ def compute_pi_chudnovsky(n_digits=33, verbose=True):
     if verbose:
         print(f"trying to get {n_digits} digits of pi with chudnovsky...")
     
-    # Set precision higher than needed
-    getcontext().prec = n_digits + 10
-    
-    C = 426880 * Decimal(10005).sqrt()
-    K = Decimal(6)
-    M = Decimal(1)
-    X = Decimal(1)
-    L = Decimal(13591409)
-    S = Decimal(13591409)
-    
-    for i in range(1, n_digits):
-        M = M * (K ** 3 - 16 * K) / ((i) ** 3)
-        K += 12
-        L += 545140134
-        X *= -262537412640768000
-        S += Decimal(M * L) / X
+    # Precision higher than needed, in a local context so other threads/engines aren't affected
+    ctx = Context(prec=n_digits + 10)
+    
+    with localcontext(ctx):
+        C = 426880 * Decimal(10005).sqrt()
+        K = Decimal(6)
+        M = Decimal(1)
+        X = Decimal(1)
+        L = Decimal(13591409)
+        S = Decimal(13591409)
+    
+        for i in range(1, n_digits):
+            M = M * (K ** 3 - 16 * K) / ((i) ** 3)
+            K += 12
+            L += 545140134
+            X *= -262537412640768000
+            S += Decimal(M * L) / X
         
-        if verbose and i % 5 == 0:
-            print(f"  iteration {i}/{n_digits}...")
+            if verbose and i % 5 == 0:
+                print(f"  iteration {i}/{n_digits}...")
     
-    pi_value = C / S
+        pi_value = C / S
     
     pi_string = str(pi_value)[:n_digits + 2]
     
@@ -44,6 +61,167 @@ def compute_pi_chudnovsky(n_digits=33, verbose=True):
     return pi_string
 
 
+# 640320^3 / 24, the Q factor of every Chudnovsky term
+CHUDNOVSKY_C3_24 = 640320 ** 3 // 24
+# each Chudnovsky term adds about log10(640320^3 / 1728) = 14.18 digits
+CHUDNOVSKY_DIGITS_PER_TERM = 14.181647462725477
+# parallel binary splitting cuts the terms into this many ranges per worker, the later ranges
+# have bigger numbers so a few more pieces than workers keeps everyone busy
+CHUDNOVSKY_RANGES_PER_WORKER = 4
+
+
+def _chudnovsky_split(a, b, one):
+    """
+    binary splitting of the chudnovsky series over terms [a, b)
+    returns P, Q, T so that the partial sum is 13591409 * ... = T / Q (with P carried for merging)
+    everything is multiplied by `one` so the products happen in whatever number type that is
+    """
+    if b - a == 1:
+        if a == 0:
+            p = q = one
+        else:
+            p = one * ((6 * a - 5) * (2 * a - 1) * (6 * a - 1))
+            q = one * (a * a * a * CHUDNOVSKY_C3_24)
+        t = p * (13591409 + 545140134 * a)
+        if a & 1:
+            t = -t
+        return p, q, t
+
+    m = (a + b) // 2
+    p1, q1, t1 = _chudnovsky_split(a, m, one)
+    p2, q2, t2 = _chudnovsky_split(m, b, one)
+    return p1 * p2, q1 * q2, q2 * t1 + p1 * t2
+
+
+def _exact_context():
+    # exact integer arithmetic: no rounding as long as nothing has more than MAX_PREC digits
+    return Context(prec=MAX_PREC, Emax=MAX_EMAX, Emin=MIN_EMIN)
+
+
+def _chudnovsky_range(a, b, backend):
+    """P, Q, T of terms [a, b) with the given backend (top level so worker processes can run it)"""
+    if backend == "gmpy2":
+        return _chudnovsky_split(a, b, gmpy2.mpz(1))
+    with localcontext(_exact_context()):
+        return _chudnovsky_split(a, b, Decimal(1))
+
+
+def _chudnovsky_parallel(terms, backend, workers):
+    """
+    same result as _chudnovsky_range(0, terms, backend), but the terms are cut into independent ranges
+    that run in worker processes, then the parent merges neighbours pairwise like _chudnovsky_split does
+    """
+    count = min(terms, workers * CHUDNOVSKY_RANGES_PER_WORKER)
+    bounds = [terms * i // count for i in range(count + 1)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parts = list(executor.map(_chudnovsky_range, bounds[:-1], bounds[1:], [backend] * count))
+
+    with localcontext(_exact_context()):
+        while len(parts) > 1:
+            merged = []
+            for left, right in zip(parts[0::2], parts[1::2]):
+                merged.append(_chudnovsky_merge(left, right))
+            if len(parts) % 2:
+                merged.append(parts[-1])
+            parts = merged
+    return parts[0]
+
+
+def _decimal_sqrt(value, prec):
+    """
+    sqrt(value) to prec digits, newton on 1/sqrt doubling the precision every step
+    (Decimal.sqrt is way slower for big precisions, this only needs multiplications)
+    """
+    x = Decimal(1 / math.sqrt(value))
+    value = Decimal(value)
+    digits = 15
+    while digits < prec:
+        digits = min(2 * digits, prec)
+        ctx = Context(prec=digits + 10, Emax=MAX_EMAX, Emin=MIN_EMIN)
+        x = ctx.divide(ctx.multiply(x, ctx.subtract(3, ctx.multiply(value, ctx.multiply(x, x)))), 2)
+    return Context(prec=prec, Emax=MAX_EMAX, Emin=MIN_EMIN).multiply(value, x)
+
+
+def _chudnovsky_backend(backend):
+    """resolve "auto" and check the backend can be used"""
+    if backend == "auto":
+        backend = "gmpy2" if gmpy2 is not None else "decimal"
+    if backend not in ("gmpy2", "decimal"):
+        raise ValueError(f"unknown backend '{backend}', expected 'auto', 'gmpy2' or 'decimal'")
+    if backend == "gmpy2" and gmpy2 is None:
+        raise ValueError("backend 'gmpy2' needs gmpy2 installed")
+    return backend
+
+
+def chudnovsky_terms(n_digits):
+    """number of chudnovsky terms needed for n_digits"""
+    return int(n_digits / CHUDNOVSKY_DIGITS_PER_TERM) + 2
+
+
+def _chudnovsky_merge(left, right):
+    """P, Q, T of two neighbouring term ranges -> P, Q, T of both (decimal needs the exact context)"""
+    p1, q1, t1 = left
+    p2, q2, t2 = right
+    return p1 * p2, q1 * q2, q2 * t1 + p1 * t2
+
+
+def _chudnovsky_finish(q, t, n_digits, backend):
+    """pi = 426880 * sqrt(10005) * Q / T, as "3.1415..." with n_digits decimals"""
+    guard = 10
+    if backend == "gmpy2":
+        one = gmpy2.mpz(10) ** (n_digits + guard)
+        pi_value = (q * 426880 * gmpy2.isqrt(10005 * one * one)) // t
+        digits = pi_value.digits(10)
+        return (digits[0] + '.' + digits[1:])[:n_digits + 2]
+
+    prec = n_digits + guard
+    ctx = Context(prec=prec, Emax=MAX_EMAX, Emin=MIN_EMIN)
+    pi_value = ctx.divide(ctx.multiply(ctx.multiply(q, 426880), _decimal_sqrt(10005, prec)), t)
+    return str(pi_value)[:n_digits + 2]
+
+
+def compute_pi_binary_splitting(n_digits=33, verbose=True, backend="auto", workers=1):
+    """
+    Chudnovsky again, but with binary splitting: the terms are combined pairwise as exact integers
+    (P, Q, T) and there's only one division and one square root at the very end.
+    Good for millions of digits.
+
+    backend:
+        "gmpy2"    gmpy2 integers (needs gmpy2 installed), fastest
+        "decimal"  exact integers in the decimal module, libmpdec multiplies big numbers much faster
+                   than int does and str() of a Decimal is linear (str(int) is quadratic and refuses
+                   more than 4300 digits by default)
+        "auto"     gmpy2 if it's installed, decimal otherwise
+
+    workers: number of processes for the series (1 = no extra processes). The final merges, the
+    square root and the division still run in this process.
+    """
+    backend = _chudnovsky_backend(backend)
+    if workers < 1:
+        raise ValueError(f"workers has to be at least 1, got {workers}")
+
+    if verbose:
+        print(f"computing pi to {n_digits} digits with binary splitting chudnovsky ({backend})...")
+
+    terms = chudnovsky_terms(n_digits)
+
+    if workers > 1:
+        _, q, t = _chudnovsky_parallel(terms, backend, workers)
+    else:
+        _, q, t = _chudnovsky_range(0, terms, backend)
+    if verbose:
+        print(f"  summed {terms} terms, dividing...")
+
+    pi_string = _chudnovsky_finish(q, t, n_digits, backend)
+
+    if verbose:
+        print()
+        print("done!")
+        print(f"pi = {pi_string}")
+
+    return pi_string
+
+
 def compute_pi_machin(n_digits=33, verbose=True):
     """
     Machin's formula: π/4 = 4*arctan(1/5) - arctan(1/239)
@@ -52,10 +230,10 @@ def compute_pi_machin(n_digits=33, verbose=True):
     if verbose:
         print(f"computing pi to {n_digits} digits with machin's formula...")
     
-    # Set precision
-    getcontext().prec = n_digits + 10
+    # Precision in a local context so other threads/engines aren't affected
+    ctx = Context(prec=n_digits + 10)
     
-    def arctan(x, num_terms=500):
+    def arctan(x, num_terms):
         """arctan using taylor series"""
         power = x
         result = power
@@ -64,18 +242,19 @@ def compute_pi_machin(n_digits=33, verbose=True):
             result += power / (2 * n + 1)
         return result
     
-    if verbose:
-        print("  calculating arctan(1/5)...")
+    with localcontext(ctx):
+        if verbose:
+            print("  calculating arctan(1/5)...")
     
-    term1 = 4 * arctan(Decimal(1) / Decimal(5))
+        term1 = 4 * arctan(Decimal(1) / Decimal(5), arctan_terms(n_digits + 10, 5))
     
-    if verbose:
-        print("  calculating arctan(1/239)...")
+        if verbose:
+            print("  calculating arctan(1/239)...")
     
-    term2 = arctan(Decimal(1) / Decimal(239))
+        term2 = arctan(Decimal(1) / Decimal(239), arctan_terms(n_digits + 10, 239))
     
-    pi_over_4 = term1 - term2
-    pi_value = 4 * pi_over_4
+        pi_over_4 = term1 - term2
+        pi_value = 4 * pi_over_4
     
     pi_string = str(pi_value)[:n_digits + 2]
     
@@ -87,6 +266,163 @@ def compute_pi_machin(n_digits=33, verbose=True):
     return pi_string
 
 
+# pi/4 = sum(coefficient * arctan(1/x)), as (coefficient, x)
+MACHIN_FORMULAS = {
+    "machin": [(4, 5), (-1, 239)],
+    "takano": [(12, 49), (32, 57), (-5, 239), (12, 110443)],
+    "stormer": [(44, 57), (7, 239), (-12, 682), (24, 12943)],
+}
+
+
+def arctan_terms(n_digits, x):
+    """how many taylor terms arctan(1/x) needs for n_digits, every term is x^2 times smaller"""
+    return int(n_digits / (2 * math.log10(x))) + 2
+
+
+def _arccot(x, digits):
+    """
+    arctan(1/x) * 10^digits as an int (fixed point), stops by itself once the terms reach 0
+    so the number of terms follows from the precision
+    """
+    x2 = x * x
+    power = 10 ** digits // x
+    total = power
+    n = 1
+    while power:
+        power //= x2
+        term = power // (2 * n + 1)
+        total = total - term if n & 1 else total + term
+        n += 1
+    return total
+
+
+def _int_to_digits(value, width):
+    """
+    value as exactly width decimal digits (zero padded), split in halves so no single str() call
+    goes over python's 4300 digit limit for int -> str
+    """
+    if width <= 4000:
+        return str(value).zfill(width)
+    low_width = width // 2
+    high, low = divmod(value, 10 ** low_width)
+    return _int_to_digits(high, width - low_width) + _int_to_digits(low, low_width)
+
+
+def compute_pi_machin_like(n_digits=33, verbose=True, formula="machin", workers=1):
+    """
+    Machin-like formulas with fixed point integers instead of Decimal: every arctan(1/x) is an
+    int scaled by 10^(n_digits + guard digits), the series run until their terms hit zero.
+    The formulas give the same digits, so they're a cheap cross-check for chudnovsky.
+
+    formula: "machin", "takano" or "stormer" (see MACHIN_FORMULAS)
+    workers: the arctan series don't depend on each other, with workers > 1 they run in that many processes
+    """
+    if formula not in MACHIN_FORMULAS:
+        raise ValueError(f"unknown formula '{formula}', expected one of {sorted(MACHIN_FORMULAS)}")
+    if workers < 1:
+        raise ValueError(f"workers has to be at least 1, got {workers}")
+
+    if verbose:
+        print(f"computing pi to {n_digits} digits with the {formula} formula (fixed point)...")
+
+    terms = MACHIN_FORMULAS[formula]
+    # every term of every series rounds down once, guard digits soak that up
+    digits = n_digits + 10 + len(str(arctan_terms(n_digits, min(x for _, x in terms))))
+    xs = [x for _, x in terms]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(xs))) as executor:
+            arccots = list(executor.map(_arccot, xs, [digits] * len(xs)))
+    else:
+        arccots = []
+        for x in xs:
+            if verbose:
+                print(f"  calculating arctan(1/{x})...")
+            arccots.append(_arccot(x, digits))
+
+    pi_value = 4 * sum(coefficient * arccot for (coefficient, _), arccot in zip(terms, arccots))
+    decimals = _int_to_digits(pi_value, digits + 1)
+    pi_string = (decimals[0] + '.' + decimals[1:])[:n_digits + 2]
+
+    if verbose:
+        print()
+        print("done!")
+        print(f"pi = {pi_string}")
+
+    return pi_string
+
+
+# q, r, t, k, m, x before the first digit
+SPIGOT_START = (1, 0, 1, 1, 3, 3)
+
+
+def spigot_digits(state=None):
+    """
+    unbounded spigot (gibbons), yields the digits of pi one by one forever: 3, 1, 4, 1, 5, ...
+    take as many as you need with itertools.islice. only q, r, t, k, m, x are kept around
+    (they do keep growing, that's the spigot state)
+
+    state: a list [q, r, t, k, m, x] to start from (SPIGOT_START = from the beginning), it's updated
+    before every digit is yielded so it can be saved and resumed later
+    """
+    q, r, t, k, m, x = SPIGOT_START if state is None else state
+    while True:
+        if 4 * q + r - t < m * t:
+            digit = m
+            q, r, t, k, m, x = (
+                10*q, 10*(r-m*t), t, k, (10*(3*q+r))//t - 10*m, x
+            )
+            if state is not None:
+                state[:] = q, r, t, k, m, x
+            yield digit
+        else:
+            q, r, t, k, m, x = (
+                q*k, (2*q+r)*x, t*x, k+1, (q*(7*k+2)+r*x)//(t*x), x+2
+            )
+
+
+# 64 KiB
+CHUNK_SIZE = 65536
+
+
+def spigot_chunks(n_digits=None, chunk_size=CHUNK_SIZE):
+    """
+    the spigot digits as text blocks of chunk_size characters ("3." then the decimals),
+    the last block can be shorter. n_digits=None keeps going forever
+    """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size has to be at least 1, got {chunk_size}")
+
+    digits = spigot_digits()
+    if n_digits is not None:
+        digits = itertools.islice(digits, n_digits + 1)
+
+    chunk = []
+    for i, digit in enumerate(digits):
+        chunk.append(str(digit))
+        if i == 0:
+            chunk.append('.')
+        if len(chunk) >= chunk_size:
+            block = ''.join(chunk)
+            yield block[:chunk_size]
+            chunk = [block[chunk_size:]] if len(block) > chunk_size else []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def write_spigot_digits(path, n_digits, chunk_size=CHUNK_SIZE):
+    """
+    write "3.1415..." with n_digits decimals to path, one chunk_size block at a time,
+    so memory doesn't grow with the file. returns the number of characters written
+    """
+    written = 0
+    with open(path, "w", encoding="ascii") as f:
+        for block in spigot_chunks(n_digits, chunk_size):
+            f.write(block)
+            written += len(block)
+    return written
+
+
 def compute_pi_simple_spigot(n_digits=33, verbose=True):
     """
     simpler spigot algorithm 
@@ -94,37 +430,12 @@ def compute_pi_simple_spigot(n_digits=33, verbose=True):
     if verbose:
         print(f"computing pi to {n_digits} digits with spigot algorithm...")
     
-    def generate_pi_digits(n):
-        """generates n digits"""
-        q, r, t, k, m, x = 1, 0, 1, 1, 3, 3
-        digits = []
-        
-        iteration = 0
-        # keep going until we have n+1 digits (including the "3")
-        while len(digits) < n + 1:
-            if verbose and iteration % 20 == 0:
-                print(f"  iteration {iteration}, generated {len(digits)} digits so far...")
-            
-            if 4 * q + r - t < m * t:
-                digits.append(m)
-                q, r, t, k, m, x = (
-                    10*q, 10*(r-m*t), t, k, (10*(3*q+r))//t - 10*m, x
-                )
-            else:
-                q, r, t, k, m, x = (
-                    q*k, (2*q+r)*x, t*x, k+1, (q*(7*k+2)+r*x)//(t*x), x+2
-                )
-            
-            iteration += 1
-            
-            # safety check to prevent infinite loop
-            if iteration > 10000:
-                print("  warning: too many iterations, stopping")
-                break
-        
-        return digits
-    
-    digits = generate_pi_digits(n_digits)
+    digits = []
+    # keep going until we have n+1 digits (including the "3")
+    for digit in itertools.islice(spigot_digits(), n_digits + 1):
+        if verbose and len(digits) % 20 == 0:
+            print(f"  generated {len(digits)} digits so far...")
+        digits.append(digit)
     
     if len(digits) > 0:
         pi_string = str(digits[0]) + '.' + ''.join(map(str, digits[1:]))
@@ -139,10 +450,421 @@ def compute_pi_simple_spigot(n_digits=33, verbose=True):
     return pi_string
 
 
-def verify_result(computed_pi, n_digits=33):
+# name -> engine, every one of them only uses local decimal contexts or plain ints so they can run
+# in threads next to each other
+METHODS = {
+    "chudnovsky": compute_pi_chudnovsky,
+    "binary_splitting": compute_pi_binary_splitting,
+    "machin": compute_pi_machin,
+    "machin_like": compute_pi_machin_like,
+    "simple_spigot": compute_pi_simple_spigot,
+}
+
+# (event loop, method, n_digits) -> future of a computation that's still running
+_in_flight = {}
+
+
+async def pi_digits(n_digits, method="binary_splitting", executor=None):
+    """
+    async version of the compute_pi_* functions for services: the computation runs on executor
+    (None = the loop's default thread pool, a ProcessPoolExecutor works too) and concurrent calls
+    for the same (method, n_digits) share one computation instead of starting their own.
+    the first caller's executor is the one that gets used
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown method '{method}', expected one of {sorted(METHODS)}")
+
+    loop = asyncio.get_running_loop()
+    key = (loop, method, n_digits)
+    future = _in_flight.get(key)
+    if future is None:
+        future = loop.run_in_executor(executor, functools.partial(METHODS[method], n_digits, verbose=False))
+        _in_flight[key] = future
+        future.add_done_callback(lambda _: _in_flight.pop(key, None))
+    # one caller giving up (cancelled) mustn't cancel the computation the others are waiting for
+    return await asyncio.shield(future)
+
+
+class DigitCache:
+    """
+    remembers computed digits per method so asking again (or for fewer digits) is free
+
+        cache = DigitCache("pi-cache", max_bytes=256 * 2**20)
+        cache.get("binary_splitting", 10000)
+        cache.get("binary_splitting", 20000)   # only the new chudnovsky terms get computed
+
+    - fewer digits than cached: a prefix slice of what's there
+    - more digits: "simple_spigot" and "binary_splitting" keep their state (spigot q, r, t, k, m, x /
+      P, Q, T of the terms so far) and carry on from it, the other methods start over
+    - directory: every method is also saved there (<method>.digits is "3.1415...", <method>.state is
+      a pickle, only point it at a directory you trust) and picked up again by a new cache
+    - max_bytes: methods that haven't been used for the longest are dropped from memory once the
+      digits and states add up to more than this (they stay on disk)
+    - hits/misses/extensions/evictions count what happened, see stats()
+    """
+
+    def __init__(self, directory=None, max_bytes=64 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # method -> (digits, state)
+        self.sizes = {}
+        self.hits = 0
+        self.misses = 0
+        self.extensions = 0
+        self.evictions = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, method, n_digits):
+        """pi with n_digits decimals ("3.1415...") computed with method, from the cache if possible"""
+        if method not in METHODS:
+            raise ValueError(f"unknown method '{method}', expected one of {sorted(METHODS)}")
+
+        digits, state = self._entry(method)
+        if len(digits) >= n_digits + 2:
+            self.hits += 1
+            return digits[:n_digits + 2]
+
+        self.misses += 1
+        if method == "simple_spigot":
+            if _spigot_resumable(digits, state):
+                self.extensions += 1
+            digits, state = self._extend_spigot(digits, state, n_digits)
+        elif method == "binary_splitting":
+            if state is not None:
+                self.extensions += 1
+            digits, state = self._extend_binary_splitting(state, n_digits)
+        else:
+            digits, state = METHODS[method](n_digits, verbose=False), None
+
+        self._store(method, digits, state)
+        return digits[:n_digits + 2]
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "extensions": self.extensions,
+            "evictions": self.evictions,
+            "bytes": sum(self.sizes.values()),
+            "methods": list(self.entries),
+        }
+
+    def _extend_spigot(self, digits, state, n_digits):
+        # the state is (len(digits) it belongs to, spigot q, r, t, k, m, x). Digits without their state
+        # (crash between the two writes, a deleted .state) can't be continued, they're computed again
+        if _spigot_resumable(digits, state):
+            spigot = list(state[1])
+        else:
+            digits, spigot = "", list(SPIGOT_START)
+        produced = max(len(digits) - 1, 0)  # the spigot counts the "3", the text also has a "."
+        new = ''.join(map(str, itertools.islice(spigot_digits(spigot), n_digits + 1 - produced)))
+        if not digits:
+            digits = new[0] + '.' + new[1:]
+        else:
+            digits += new
+        return digits, (len(digits), tuple(spigot))
+
+    def _extend_binary_splitting(self, state, n_digits):
+        backend = _chudnovsky_backend("auto")
+        if state is not None and state[0] != backend:
+            state = None  # made with a backend that isn't around any more
+        needed = chudnovsky_terms(n_digits)
+        if state is None:
+            terms, pqt = needed, _chudnovsky_range(0, needed, backend)
+        else:
+            _, terms, pqt = state
+            if needed > terms:
+                with localcontext(_exact_context()):
+                    pqt = _chudnovsky_merge(pqt, _chudnovsky_range(terms, needed, backend))
+                terms = needed
+        return _chudnovsky_finish(pqt[1], pqt[2], n_digits, backend), (backend, terms, pqt)
+
+    def _entry(self, method):
+        if method in self.entries:
+            self.entries.move_to_end(method)
+            return self.entries[method]
+        if self.directory is not None and os.path.exists(self._path(method, "digits")):
+            with open(self._path(method, "digits"), "r", encoding="ascii") as f:
+                digits = f.read()
+            state = None
+            if os.path.exists(self._path(method, "state")):
+                with open(self._path(method, "state"), "rb") as f:
+                    state = pickle.load(f)
+            self._remember(method, digits, state)
+            return digits, state
+        return "", None
+
+    def _store(self, method, digits, state):
+        if self.directory is not None:
+            # state first: new digits never sit next to an older state, see _extend_spigot
+            if state is not None:
+                self._write(self._path(method, "state"), pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+            self._write(self._path(method, "digits"), digits.encode("ascii"))
+        self._remember(method, digits, state)
+
+    def _remember(self, method, digits, state):
+        self.entries[method] = (digits, state)
+        self.entries.move_to_end(method)
+        self.sizes[method] = sys.getsizeof(digits) + _state_size(state)
+        while self.entries and sum(self.sizes.values()) > self.max_bytes:
+            oldest, _ = self.entries.popitem(last=False)
+            del self.sizes[oldest]
+            self.evictions += 1
+
+    def _path(self, method, kind):
+        return os.path.join(self.directory, f"{method}.{kind}")
+
+    @staticmethod
+    def _write(path, data):
+        # same as checkpoints: a crash mid-write leaves the old file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+def _spigot_resumable(digits, state):
+    """True if state is a simple_spigot state saved together with exactly these digits"""
+    return isinstance(state, tuple) and len(state) == 2 and state[0] == len(digits)
+
+
+def _state_size(state):
+    if state is None:
+        return 0
+    if isinstance(state, (tuple, list)):
+        return sys.getsizeof(state) + sum(_state_size(item) for item in state)
+    return sys.getsizeof(state)
+
+
+# extra bits kept by the BBP sums so the rounding of every term can't reach the digits we return
+BBP_GUARD_BITS = 64
+# a hex digit is worth log10(16) decimal digits, keep this many decimals spare when converting
+HEX_GUARD_DECIMALS = 10
+
+# checked: how many positions were looked at, mismatches: [(position, expected hex, hex from the digits)]
+SpotCheckResult = namedtuple("SpotCheckResult", ["ok", "checked", "mismatches"])
+
+
+def _bbp_series(j, n, bits):
+    """fractional part of 16^n * sum(1 / (16^k * (8k + j))) as a fixed point number with `bits` bits"""
+    mask = (1 << bits) - 1
+    total = 0
+    for k in range(n + 1):
+        m = 8 * k + j
+        total += (pow(16, n - k, m) << bits) // m
+    total &= mask
+    # the terms after n are below one, they run out after bits/4 more
+    k = n + 1
+    while 4 * (k - n) < bits:
+        total += (1 << (bits - 4 * (k - n))) // (8 * k + j)
+        k += 1
+    return total & mask
+
+
+def bbp_hex_digits(position, count=8):
+    """
+    Bailey-Borwein-Plouffe digit extraction: count hex digits of pi starting at position
+    (1 = the first hex digit after the point, pi = 3.243F6A88...), without computing the ones before
+    """
+    if position < 1 or count < 1:
+        raise ValueError(f"position and count have to be at least 1, got {position} and {count}")
+    n = position - 1
+    bits = 4 * count + BBP_GUARD_BITS
+    fraction = (4 * _bbp_series(1, n, bits) - 2 * _bbp_series(4, n, bits)
+                - _bbp_series(5, n, bits) - _bbp_series(6, n, bits)) & ((1 << bits) - 1)
+    return format(fraction >> BBP_GUARD_BITS, f"0{count}X")
+
+
+def hex_positions_available(computed_pi):
+    """how many hex digits after the point the decimal digits in computed_pi pin down"""
+    decimals = len(computed_pi.partition('.')[2])
+    return max(0, int((decimals - HEX_GUARD_DECIMALS) / math.log10(16)))
+
+
+def decimal_to_hex_digits(computed_pi, position, count=8):
+    """
+    the hex digits at position..position+count-1 of a decimal result ("3.1415..."), same numbering
+    as bbp_hex_digits. only needs a local decimal context, the global one isn't touched
+    """
+    last = position + count - 1
+    if position < 1 or last > hex_positions_available(computed_pi):
+        raise ValueError(f"hex digits {position}..{last} aren't determined by "
+                         f"{len(computed_pi.partition('.')[2])} decimals")
+    decimals = computed_pi.partition('.')[2]
+    ctx = Context(prec=len(decimals) + 2 * HEX_GUARD_DECIMALS, Emax=MAX_EMAX, Emin=MIN_EMIN)
+    # 16^last * fraction, its integer part ends in the hex digits we want
+    scaled = ctx.multiply(Decimal("0." + decimals), ctx.power(16, last))
+    digits = ctx.remainder(scaled.to_integral_value(rounding=ROUND_FLOOR, context=ctx), ctx.power(16, count))
+    return format(int(digits), f"0{count}X")
+
+
+def spot_check(computed_pi, samples=8, count=8, workers=1, seed=None, positions=None):
+    """
+    probabilistic check of a long result: convert a few random stretches to hex and compare them
+    with BBP, which gets those digits straight from the position. no reference file needed.
+    the BBP side runs in `workers` processes
+
+    positions: check these hex positions instead of random ones
+    """
+    if workers < 1:
+        raise ValueError(f"workers has to be at least 1, got {workers}")
+    available = hex_positions_available(computed_pi)
+    if positions is None:
+        if available < count:
+            raise ValueError(f"{computed_pi[:20]}... is too short to spot check {count} hex digits")
+        rng = random.Random(seed)
+        positions = sorted(rng.randint(1, available - count + 1) for _ in range(samples))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            expected = list(executor.map(bbp_hex_digits, positions, [count] * len(positions)))
+    else:
+        expected = [bbp_hex_digits(position, count) for position in positions]
+
+    mismatches = []
+    for position, want in zip(positions, expected):
+        got = decimal_to_hex_digits(computed_pi, position, count)
+        if got != want:
+            mismatches.append((position, want, got))
+    return SpotCheckResult(not mismatches, len(positions), mismatches)
+
+
+# bytes compared per slice when looking for the first mismatch
+VERIFY_CHUNK_SIZE = 1 << 20
+
+# matched: characters that agree from the start, compared: how many could be compared (the shorter length),
+# mismatch: index of the first difference or None. ok needs every computed character compared, a reference
+# that ends early isn't a pass even without a mismatch
+VerifyResult = namedtuple("VerifyResult", ["ok", "matched", "compared", "mismatch"])
+
+
+def common_prefix_length(a, b, chunk_size=VERIFY_CHUNK_SIZE):
+    """
+    length of the common prefix of two bytes-like objects (bytes, mmap, ...)
+    whole chunks are compared with ==, only a differing chunk gets bisected, no per-char loop
+    """
+    n = min(len(a), len(b))
+    lo = 0
+    while lo < n:
+        hi = min(lo + chunk_size, n)
+        if a[lo:hi] != b[lo:hi]:
+            # a[lo:hi] != b[lo:hi] holds the whole time
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if a[lo:mid] == b[lo:mid]:
+                    lo = mid
+                else:
+                    hi = mid
+            return lo
+        lo = hi
+    return n
+
+
+def _open_reference(path):
+    """read-only mmap of a reference digit file ("3.1415..."), empty files can't be mapped so they're b"" """
+    with open(path, "rb") as f:
+        if f.seek(0, 2) == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _reference_length(reference):
+    # ignore a trailing newline/whitespace at the end of the file
+    length = len(reference)
+    while length and reference[length - 1:length] in (b"\n", b"\r", b" ", b"\t"):
+        length -= 1
+    return length
+
+
+def verify_against_file(computed_pi, reference_path):
+    """
+    compare computed digits ("3.1415...") with a reference file in the same format,
+    the file is memory mapped so it can be as big as you like (10M digits is fine)
+    """
+    computed = computed_pi.encode("ascii") if isinstance(computed_pi, str) else computed_pi
+    reference = _open_reference(reference_path)
+    try:
+        compared = min(len(computed), _reference_length(reference))
+        with memoryview(reference) as view:
+            matched = common_prefix_length(computed[:compared], view[:compared])
+    finally:
+        if isinstance(reference, mmap.mmap):
+            reference.close()
+    mismatch = matched if matched < compared else None
+    return VerifyResult(mismatch is None and compared == len(computed), matched, compared, mismatch)
+
+
+class StreamVerifier:
+    """
+    check digits while they're still being produced, e.g. straight from spigot_chunks():
+
+        with StreamVerifier("pi-10m.txt") as verifier:
+            for block in spigot_chunks(n):
+                if not verifier.feed(block):
+                    break
+        print(verifier.result())
+
+    only the current block is held in memory, the reference stays memory mapped
+    """
+
+    def __init__(self, reference_path):
+        self.reference = _open_reference(reference_path)
+        self.length = _reference_length(self.reference)
+        self.position = 0  # characters fed so far
+        self.mismatch = None
+
+    def feed(self, block):
+        """compare the next block, returns False once a mismatch has been found"""
+        if self.mismatch is not None:
+            return False
+        data = block.encode("ascii") if isinstance(block, str) else block
+        start = self.position
+        end = min(start + len(data), self.length)
+        if end > start:
+            matched = common_prefix_length(data[:end - start], self.reference[start:end])
+            if matched < end - start:
+                self.mismatch = start + matched
+        self.position += len(data)
+        return self.mismatch is None
+
+    def result(self):
+        compared = min(self.position, self.length)
+        matched = compared if self.mismatch is None else self.mismatch
+        return VerifyResult(self.mismatch is None and compared == self.position, matched, compared, self.mismatch)
+
+    def close(self):
+        if isinstance(self.reference, mmap.mmap):
+            self.reference.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def verify_result(computed_pi, n_digits=33, reference_path=None):
     """
     check if we got the right answer
+    with reference_path the digits are checked against that file (see verify_against_file)
+    instead of the 100 digits below
     """
+    if reference_path is not None:
+        result = verify_against_file(computed_pi, reference_path)
+        print()
+        print(f"checking answer against {reference_path}...")
+        if result.ok:
+            print(f"digits match ({result.matched} characters compared)")
+        elif result.mismatch is None:
+            print(f"the reference only covers {result.compared} of {len(computed_pi)} characters, "
+                  f"those match but the last {len(computed_pi) - result.compared} aren't verified")
+        else:
+            print(f"uh oh, only matched {result.matched} characters")
+            print(f"  difference at position {result.mismatch}: got '{computed_pi[result.mismatch]}'")
+        print()
+        return result
+
     # known digits for checking
     known_pi = "3.1415926535897932384626433832795028841971693993751058209749445923078164062862089986280348253421170679"
     
@@ -186,4 +908,11 @@ if __name__ == "__main__":
     result2 = compute_pi_machin(n_digits=33, verbose=True)
     verify_result(result2, n_digits=33)
     
+    print()
+
+    # binary splitting
+    print("method 3: binary splitting chudnovsky")
+    result3 = compute_pi_binary_splitting(n_digits=33, verbose=True)
+    verify_result(result3, n_digits=33)
+
     print("all done!\n")
\ No newline at end of file